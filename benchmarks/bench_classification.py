@@ -0,0 +1,60 @@
+"""
+Benchmark comparing the per-row classification loop with batched classification against the offline StubBackend.
+
+Usage: python benchmarks/bench_classification.py [--rows N] [--latency SPEC] [--error-rate RATE]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'food_chatbot.settings')
+
+import django
+
+django.setup()
+
+from chatbot import llm, metrics
+from chatbot.backends import StubBackend
+from chatbot.classification import classify_batch, classify_text
+from chatbot.dietary import classify_foods
+
+
+def make_texts(rows, seed=0):
+    rng = random.Random(seed)
+    return [f"1. {a}\n2. {b}\n3. {c}" for a, b, c in (rng.sample(StubBackend.FOODS, 3) for _ in range(rows))]
+
+
+def run(name, func, texts):
+    """
+    Classifies texts with func and reports its LLM calls, as counted by chatbot.metrics, wall time and accuracy.
+    The stub labels texts with the dietary vocabulary, so that is the expected answer.
+    """
+    calls_before = metrics.LLM_REQUESTS.total()
+    start = time.perf_counter()
+    labels = func(texts)
+    elapsed = time.perf_counter() - start
+    correct = sum(label == classify_foods(text).verdict for label, text in zip(labels, texts))
+    print(f"{name:<10} calls={metrics.LLM_REQUESTS.total() - calls_before:<6} wall={elapsed:8.3f}s accuracy={correct}/{len(texts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=300, help="Number of conversations to classify")
+    parser.add_argument("--latency", default="fixed:0.02", help="Stub LLM latency distribution, see LLM_STUB_LATENCY")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Fraction of stub LLM calls failing with a 429")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the texts and stub")
+    args = parser.parse_args()
+
+    llm.rate_limiter.rate = 0   # Measures the classifier, not the configured API quota
+    texts = make_texts(args.rows, args.seed)
+    for name, func in (("per-row", lambda items: [classify_text(text) for text in items]), ("batched", classify_batch)):
+        llm.set_backend(StubBackend(latency=args.latency, error_rate=args.error_rate, seed=args.seed))
+        run(name, func, texts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Microbenchmark comparing the compiled dietary matcher with the original substring scan of check_vegetarian.
+
+Usage: python benchmarks/bench_dietary.py [--repeat N]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from chatbot.dietary import classify_foods
+
+LEGACY_KEYWORDS = ["chicken", "beef", "pork", "fish", "shrimp", "lamb", "turkey", "duck", "venison", "goat",
+                   "rabbit", "veal", "bacon", "sausage", "ham", "salami", "prosciutto", "crab", "lobster",
+                   "squid", "octopus", "clams", "mussels", "oysters", "scallops", "gelatin", "broth", "stock",
+                   "lard", "suet", "tallow", "meat", "seafood", "poultry", "game"]
+
+
+def legacy_check_vegetarian(foods):
+    """
+    The original check_vegetarian implementation: a substring scan over every keyword for every food.
+    """
+    for food in foods:
+        food_lower = food.lower()
+        if any(keyword in food_lower for keyword in LEGACY_KEYWORDS):
+            return False
+    return True
+
+
+def compiled_check_vegetarian(foods):
+    return classify_foods(", ".join(foods)).verdict != "neither"
+
+
+def load_samples():
+    """
+    Loads the simulated answers from conversation_results.txt as lists of lines, one list per conversation.
+    """
+    text = (ROOT / "conversation_results.txt").read_text()
+    samples = []
+    for block in text.split("------"):
+        if "Answer:" in block:
+            answer = block.split("Answer:", 1)[1]
+            samples.append([line.strip() for line in answer.splitlines() if line.strip()])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20, help="Number of passes over the sample conversations")
+    args = parser.parse_args()
+
+    samples = load_samples() + [["graham crackers"], ["gamer snacks"], ["eggplant"], ["peanut butter"]]
+    for name, func in (("substring", legacy_check_vegetarian), ("compiled", compiled_check_vegetarian)):
+        elapsed = timeit.timeit(lambda: [func(foods) for foods in samples], number=args.repeat)
+        print(f"{name:<10} {elapsed / (args.repeat * len(samples)) * 1e6:8.2f} us/conversation")
+
+    disagreements = [foods for foods in samples if legacy_check_vegetarian(foods) != compiled_check_vegetarian(foods)]
+    print(f"{len(disagreements)} of {len(samples)} conversations classified differently, e.g.:")
+    for foods in disagreements[:5]:
+        print(f"  {' | '.join(foods)[:100]} -> {classify_foods(', '.join(foods))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+End-to-end load benchmark for the chatbot, simulation and vegetarian users endpoints.
+
+Requests are driven in-process through Django's ASGI test client against a throwaway test database
+and the offline StubBackend, so runs need no network access or API quota and are repeatable.
+For each endpoint it reports p50/p95/p99 latency, throughput and database queries per request,
+plus how much it raised the process's peak RSS, and the peak RSS of the whole run. Results are written
+as JSON for regression comparisons.
+
+Usage: python benchmarks/bench_endpoints.py [--conversations N] [--requests N] [--concurrency N]
+                                            [--latency SPEC] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'food_chatbot.settings')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment
+
+from chatbot import llm, metrics
+from chatbot.backends import StubBackend
+from chatbot.models import Conversation, ConversationFood, Food
+
+WELL_FORMED_INPUTS = ["1. {} 2. {} 3. {}", "{}, {} and {}", "- {}\n- {}\n- {}"]
+CONVERSATIONAL_INPUTS = ["Hmm, I really like {} but I'm not sure what else?", "Is {} a food? I like it a lot"]
+
+def seed_conversations(count, seed):
+    """
+    Bulk-inserts synthetic conversations with three linked foods each.
+
+    :param count: The number of conversations to create
+    :param seed: The random seed, so datasets are identical across runs
+    """
+    rng = random.Random(seed)
+    Food.objects.bulk_create([Food(name=name) for name in StubBackend.FOODS], ignore_conflicts=True)
+    food_ids = dict(Food.objects.values_list('name', 'id'))
+    for start in range(0, count, 1000):
+        batch = [rng.sample(StubBackend.FOODS, 3) for _ in range(min(1000, count - start))]
+        conversations = Conversation.objects.bulk_create([
+            Conversation(user_input=", ".join(names), bot_response="\n".join(f"{i}. {name}" for i, name in enumerate(names, 1)))
+            for names in batch
+        ])
+        ConversationFood.objects.bulk_create([
+            ConversationFood(conversation=conversation, food_id=food_ids[name], position=position)
+            for conversation, names in zip(conversations, batch) for position, name in enumerate(names)
+        ])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024    # ru_maxrss is in KiB on Linux
+
+
+async def run_endpoint(name, make_request, requests, concurrency):
+    """
+    Sends requests to one endpoint from a fixed number of concurrent workers.
+
+    :param name: The scenario name used in the report
+    :param make_request: An async function taking the AsyncClient and request number and returning a response
+    :param requests: The total number of requests to send
+    :param concurrency: The number of requests kept in flight
+    :return: A dictionary of latency, throughput, query, error and memory statistics
+    """
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        client = AsyncClient()
+        for number in remaining:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, number)
+                if getattr(response, "streaming", False):
+                    async for _ in response.streaming_content:
+                        pass
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1     # E.g. a 429 that outlasted the retries; the run continues
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    # Queries are counted by the request metrics middleware, like in production
+    requests_before, queries_before = metrics.REQUEST_QUERIES.totals()
+    peak_rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    requests_after, queries_after = metrics.REQUEST_QUERIES.totals()
+    return {
+        "endpoint": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "queries_per_request": (queries_after - queries_before) / (requests_after - requests_before) if requests_after > requests_before else 0.0,
+        # The peak RSS of a process only grows, so this is the growth during the endpoint, 0 if it stayed below earlier peaks
+        "peak_rss_growth_mb": peak_rss_mb() - peak_rss_before,
+    }
+
+
+def scenarios(args, auth):
+    rng = random.Random(args.seed)
+
+    async def chat(client, number):
+        foods = rng.sample(StubBackend.FOODS, 3)
+        if rng.random() < args.conversational:
+            text = rng.choice(CONVERSATIONAL_INPUTS).format(foods[0])
+        else:
+            text = rng.choice(WELL_FORMED_INPUTS).format(*foods)
+        return await client.post("/", {"user_input": text})
+
+    async def chat_stream(client, number):
+        return await client.post("/", {"user_input": rng.choice(CONVERSATIONAL_INPUTS).format(rng.choice(StubBackend.FOODS))},
+                                 headers={"Accept": "text/event-stream"})
+
+    async def simulate(client, number):
+        return await client.post("/simulate/")
+
+    async def vegetarian(client, number):
+        return await client.get("/api/vegetarian/", {"page_size": args.page_size}, headers=auth)
+
+    async def vegetarian_stream(client, number):
+        return await client.get("/api/vegetarian/", {"page_size": args.page_size, "stream": "true"}, headers=auth)
+
+    async def search(client, number):
+        return await client.get("/api/search/", {"q": rng.choice(StubBackend.FOODS)}, headers=auth)
+
+    return {
+        "chatbot": (chat, args.requests),
+        "chatbot_stream": (chat_stream, args.requests),
+        "simulate": (simulate, max(args.requests // 20, 1)),
+        "vegetarian_api": (vegetarian, args.requests),
+        "vegetarian_api_stream": (vegetarian_stream, max(args.requests // 10, 1)),
+        "search_api": (search, args.requests),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Prints the change of each metric against a previous results file and flags regressions.
+
+    :return: True if any latency or throughput metric regressed by more than threshold percent
+    """
+    baseline = {entry["endpoint"]: entry for entry in json.loads(Path(baseline_path).read_text())["endpoints"]}
+    regressed = False
+    for entry in results["endpoints"]:
+        previous = baseline.get(entry["endpoint"])
+        if not previous:
+            continue
+        for metric, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput_rps", False)):
+            if not previous[metric]:
+                continue
+            change = (entry[metric] - previous[metric]) / previous[metric] * 100
+            worse = change > threshold if higher_is_worse else change < -threshold
+            regressed |= worse
+            print(f"  {entry['endpoint']:<22} {metric:<15} {previous[metric]:10.1f} -> {entry[metric]:10.1f} "
+                  f"({change:+.1f}%){'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=2000, help="Number of stored conversations to seed")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests kept in flight per endpoint")
+    parser.add_argument("--page-size", type=int, default=100, help="page_size for the vegetarian users API")
+    parser.add_argument("--conversational", type=float, default=0.3, help="Fraction of chat inputs that need the LLM")
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="Stub LLM latency distribution, see LLM_STUB_LATENCY")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub LLM calls failing with a 429")
+    parser.add_argument("--endpoints", default="chatbot,chatbot_stream,simulate,vegetarian_api,vegetarian_api_stream,search_api",
+                        help="Comma-separated scenarios to run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the dataset, inputs and stub")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="A previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        llm.set_backend(StubBackend(latency=args.latency, error_rate=args.error_rate, seed=args.seed))
+        llm.rate_limiter.rate = 0   # Measures the application, not the configured API quota
+        seed_conversations(args.conversations, args.seed)
+        User.objects.create_user("bench", password="bench")
+        auth = {"Authorization": "Basic " + base64.b64encode(b"bench:bench").decode()}
+
+        available = scenarios(args, auth)
+        results = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": vars(args),
+            "endpoints": [],
+        }
+        for name in args.endpoints.split(","):
+            make_request, requests = available[name]
+            entry = asyncio.run(run_endpoint(name, make_request, requests, args.concurrency))
+            results["endpoints"].append(entry)
+            print(f"{name:<22} p50={entry['p50_ms']:8.1f}ms p95={entry['p95_ms']:8.1f}ms p99={entry['p99_ms']:8.1f}ms "
+                  f"rps={entry['throughput_rps']:8.1f} queries/req={entry['queries_per_request']:6.1f} errors={entry['errors']} "
+                  f"peak RSS +{entry['peak_rss_growth_mb']:.1f} MiB")
+        results["process_peak_rss_mb"] = peak_rss_mb()
+        print(f"process peak RSS over all endpoints: {results['process_peak_rss_mb']:.1f} MiB")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
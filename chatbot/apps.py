@@ -7,4 +7,14 @@ class ChatbotConfig(AppConfig):
     for model primary keys and identifying the app name during project setup.
     """
     default_auto_field = "django.db.models.BigAutoField" # Specifies the default auto-incrementing primary key field type as a 64-bit integer for models in the chatbot app
-    name = "chatbot" # Defines the name of the application as 'chatbot' for Django to recognize and load it
\ No newline at end of file
+    name = "chatbot" # Defines the name of the application as 'chatbot' for Django to recognize and load it
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from .metrics import install_query_hook
+        from .search import restore_search_index
+        connection_created.connect(install_query_hook) # Times every database query for the request metrics
+        post_migrate.connect(restore_search_index, sender=self)  # Recreates search index triggers that a migration dropped
+        from . import stats  # noqa: F401 - Registers the signal handlers keeping the aggregate statistics up to date
+        from . import checks  # noqa: F401 - Registers the search index system check
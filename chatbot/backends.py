@@ -0,0 +1,361 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+import weakref
+from types import SimpleNamespace
+
+import openai
+from django.conf import settings
+
+try:
+    import httpx2 as httpx  # The HTTP library of openai 3 and later
+except ImportError:
+    import httpx
+from openai.types.chat import ChatCompletion
+
+from .dietary import ANIMAL_PRODUCT_TERMS, MEAT_TERMS, PLANT_TERMS, classify_foods
+from .parsing import split_foods
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBackend:
+    """
+    The interface every LLM backend implements. Requests are chat.completions.create keyword arguments and
+    completions are openai ChatCompletion objects, whichever backend produced them. Rate limiting, concurrency
+    and retries are applied around the backend by chatbot.llm, so backends only make the call.
+    """
+    def complete(self, **kwargs):
+        """
+        :param kwargs: The chat completions request
+        :return: A ChatCompletion
+        """
+        raise NotImplementedError
+
+    async def acomplete(self, **kwargs):
+        """
+        :param kwargs: The chat completions request
+        :return: A ChatCompletion
+        """
+        raise NotImplementedError
+
+    async def astream(self, **kwargs):
+        """
+        :param kwargs: The chat completions request, without 'stream'
+        :return: An async generator of completion text deltas
+        """
+        raise NotImplementedError
+        yield
+
+    async def awarm_up(self):
+        """
+        Prepares the backend for the async calls of the running event loop.
+        """
+
+
+def client_options(http_client_class):
+    """
+    Builds the arguments shared by every OpenAI client: explicit connect and read timeouts, and a keep-alive
+    connection pool of LLM_POOL_MAX_CONNECTIONS, so calls after the first reuse an open TLS connection.
+    Client retries are disabled because chatbot.llm retries transient errors through the shared rate limiter.
+
+    :param http_client_class: openai.DefaultHttpxClient or openai.DefaultAsyncHttpxClient
+    :return: The keyword arguments of openai.OpenAI or openai.AsyncOpenAI
+    """
+    timeout = openai.Timeout(settings.LLM_READ_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+    limits = httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+    return {
+        "api_key": settings.OPENAI_API_KEY,
+        "timeout": timeout,
+        "max_retries": 0,
+        "http_client": http_client_class(timeout=timeout, limits=limits),
+    }
+
+
+async def close_with_loop(client):
+    """
+    An async generator that stays suspended for the life of an event loop and closes an async client when
+    the loop finalizes its async generators on shutdown, as asyncio.run() and asgiref do, so a client built for
+    a short-lived loop does not leave its connections open.
+
+    :param client: The openai.AsyncOpenAI client of the loop
+    """
+    try:
+        yield
+    finally:
+        await client.close()
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Sends requests to the OpenAI API. The sync client is created once per process, and each event loop gets
+    its own async client because its connection pool is bound to the loop that created it. Both are created
+    on first use; the ASGI lifespan startup brings the async client of the worker's event loop forward by
+    calling awarm_up(). The sync client, which request handling does not use, is left to be created lazily.
+    """
+    def __init__(self):
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._loop_closers = weakref.WeakKeyDictionary()   # Event loop -> its close_with_loop() generator
+
+    def get_client(self):
+        with self._client_lock:     # Sync calls come from several threads
+            if self._client is None:
+                self._client = openai.OpenAI(**client_options(openai.DefaultHttpxClient))
+            return self._client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(**client_options(openai.DefaultAsyncHttpxClient))
+            closer = close_with_loop(client)
+            asyncio.ensure_future(anext(closer))    # Runs the closer to its yield, registering it with the loop
+            self._async_clients[loop] = client
+            self._loop_closers[loop] = closer
+        return client
+
+    async def awarm_up(self):
+        # Retrieving the configured model is a free, authenticated request that opens a pooled connection. It has
+        # its own short timeout, so an unreachable API delays a worker's start-up by seconds rather than a minute.
+        client = self.get_async_client().with_options(timeout=settings.LLM_WARM_UP_TIMEOUT)
+        await client.models.retrieve(settings.CHATBOT_MODEL)
+
+    def complete(self, **kwargs):
+        return self.get_client().chat.completions.create(**kwargs)
+
+    async def acomplete(self, **kwargs):
+        return await self.get_async_client().chat.completions.create(**kwargs)
+
+    async def astream(self, **kwargs):
+        stream = await self.get_async_client().chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+def request_key(kwargs):
+    """
+    Computes the key under which a request is recorded and replayed, ignoring whether it was streamed.
+
+    :param kwargs: The chat completions request
+    :return: A SHA-256 hex digest of the canonical JSON request
+    """
+    request = {key: value for key, value in kwargs.items() if key != 'stream'}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def make_completion(content, model, prompt_tokens=0):
+    """
+    Builds a ChatCompletion for a stub or streamed answer, with estimated token usage.
+
+    :param content: The completion text
+    :param model: The requested model name
+    :param prompt_tokens: The estimated number of prompt tokens
+    :return: A ChatCompletion
+    """
+    completion_tokens = len(content) // 4 + 1
+    return ChatCompletion.model_validate({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Wraps another backend and appends every request and its completion to a JSONL file, one
+    {"request", "response", "latency"} object per line, for later replay by StubBackend.
+    """
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, kwargs, completion, latency):
+        line = json.dumps({"request": kwargs, "response": completion.model_dump(mode="json"), "latency": latency}, default=str)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def complete(self, **kwargs):
+        start = time.perf_counter()
+        completion = self.inner.complete(**kwargs)
+        self.record(kwargs, completion, time.perf_counter() - start)
+        return completion
+
+    async def acomplete(self, **kwargs):
+        start = time.perf_counter()
+        completion = await self.inner.acomplete(**kwargs)
+        self.record(kwargs, completion, time.perf_counter() - start)
+        return completion
+
+    async def astream(self, **kwargs):
+        start = time.perf_counter()
+        tokens = []
+        async for token in self.inner.astream(**kwargs):
+            tokens.append(token)
+            yield token
+        self.record(kwargs, make_completion("".join(tokens), kwargs.get("model", "")), time.perf_counter() - start)
+
+    async def awarm_up(self):
+        await self.inner.awarm_up()
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution such as 'fixed:0.5', 'uniform:0.2,1.5', 'exponential:0.5' (mean)
+    or 'lognormal:0.8,0.5' (median, sigma). All values are in seconds.
+
+    :param spec: The distribution specification
+    :return: A function taking a random.Random and returning a latency in seconds
+    :raises ValueError: If the specification is not recognised
+    """
+    name, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if name == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == "exponential" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if name == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class StubBackend(LLMBackend):
+    """
+    An offline backend for load tests and benchmarks. It replays answers recorded by RecordingBackend when
+    a request matches one, and otherwise synthesizes a plausible answer: a label or JSON batch for
+    classification prompts and a numbered list of three foods for everything else. Latency is drawn from
+    a configurable distribution and a configurable fraction of calls fail with an API error. A fixed seed
+    makes every run repeatable.
+    """
+    FOODS = sorted(set(MEAT_TERMS + ANIMAL_PRODUCT_TERMS + PLANT_TERMS))
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, error_status=429, replay_path=None, seed=0):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()    # random.Random is shared by worker threads and event loops
+        self.recorded = {}
+        if replay_path:
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recorded[request_key(entry["request"])] = entry["response"]["choices"][0]["message"]["content"]
+            logger.info(f"Loaded {len(self.recorded)} recorded LLM responses from {replay_path}")
+
+    def draw(self):
+        """
+        Draws the latency and outcome of one call.
+
+        :return: A (latency in seconds, whether the call fails) tuple
+        """
+        with self.lock:
+            return max(self.latency(self.rng), 0.0), self.rng.random() < self.error_rate
+
+    def error(self):
+        # A minimal stand-in for the HTTP response, carrying what openai's errors and chatbot.llm read from it
+        response = SimpleNamespace(request=None, status_code=self.error_status, headers={"retry-after": "0.1"})
+        error_class = openai.RateLimitError if self.error_status == 429 else openai.InternalServerError
+        return error_class(f"Stub error {self.error_status}", response=response, body=None)
+
+    def answer(self, kwargs):
+        """
+        Returns the recorded answer for a request, or synthesizes one.
+
+        :param kwargs: The chat completions request
+        :return: The completion text
+        """
+        recorded = self.recorded.get(request_key(kwargs))
+        if recorded is not None:
+            return recorded
+        from .classification import CLASSIFICATION_PROMPT
+        from .memory import SUMMARY_PROMPT
+        messages = kwargs.get("messages", [])
+        content = messages[-1]["content"] if messages else ""
+        if kwargs.get("response_format"):
+            items = json.loads(content)
+            return json.dumps({"results": [
+                {"id": item["id"], "label": classify_foods(item["text"]).verdict or "neither"} for item in items
+            ]})
+        if messages and messages[0]["content"] == CLASSIFICATION_PROMPT:
+            return classify_foods(content).verdict or "neither"
+        if messages and messages[0]["content"] == SUMMARY_PROMPT:
+            return content[-300:]   # The most recent part of the transcript stands in for its summary
+        foods = split_foods(content)
+        if len(foods) != 3:
+            with self.lock:
+                foods = self.rng.sample(self.FOODS, 3)
+        listed = "\n".join(f"{position}. {food}" for position, food in enumerate(foods, start=1))
+        return f"Thanks for sharing! Here are the top 3 favorite foods:\n{listed}"
+
+    def completion(self, kwargs):
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in kwargs.get("messages", [])) // 4
+        return make_completion(self.answer(kwargs), kwargs.get("model", ""), prompt_tokens)
+
+    def complete(self, **kwargs):
+        latency, failed = self.draw()
+        time.sleep(latency)
+        if failed:
+            raise self.error()
+        return self.completion(kwargs)
+
+    async def acomplete(self, **kwargs):
+        latency, failed = self.draw()
+        await asyncio.sleep(latency)
+        if failed:
+            raise self.error()
+        return self.completion(kwargs)
+
+    async def astream(self, **kwargs):
+        latency, failed = self.draw()
+        await asyncio.sleep(latency)    # The drawn latency is the time to first token
+        if failed:
+            raise self.error()
+        for token in re.findall(r"\S+\s*|\s+", self.answer(kwargs)):
+            yield token
+
+
+def build_backend():
+    """
+    Builds the backend configured in settings: LLM_BACKEND selects 'openai' or 'stub', the stub is tuned by
+    the LLM_STUB_* settings and replays LLM_REPLAY_PATH, and LLM_RECORD_PATH wraps either in a recorder.
+
+    :return: An LLMBackend
+    :raises ValueError: If LLM_BACKEND is not recognised
+    """
+    if settings.LLM_BACKEND == "openai":
+        backend = OpenAIBackend()
+    elif settings.LLM_BACKEND == "stub":
+        backend = StubBackend(
+            latency=settings.LLM_STUB_LATENCY,
+            error_rate=settings.LLM_STUB_ERROR_RATE,
+            error_status=settings.LLM_STUB_ERROR_STATUS,
+            replay_path=settings.LLM_REPLAY_PATH,
+            seed=settings.LLM_STUB_SEED,
+        )
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND: {settings.LLM_BACKEND}")
+    if settings.LLM_RECORD_PATH:
+        backend = RecordingBackend(backend, settings.LLM_RECORD_PATH)
+    return backend
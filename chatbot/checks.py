@@ -0,0 +1,21 @@
+from django.core.checks import Tags, Warning, register
+
+from .search import missing_search_objects
+
+
+@register(Tags.database)
+def check_search_index(app_configs, databases=None, **kwargs):
+    """
+    Warns when objects of the conversation search index are missing, e.g. SQLite triggers dropped by a
+    migration that rebuilt the conversation table, since the index then silently goes stale.
+    """
+    warnings = []
+    for alias in databases or []:
+        missing = missing_search_objects(alias)
+        if missing:
+            warnings.append(Warning(
+                f"The conversation search index on database '{alias}' is missing {', '.join(missing)}",
+                hint="Run 'manage.py rebuild_search_index' to recreate them and reindex the conversations.",
+                id='chatbot.W001',
+            ))
+    return warnings
@@ -0,0 +1,281 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import llm, metrics
+from .dietary import classify_foods
+from .models import Classification
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_PROMPT = ("Analyze the following list of favorite foods and determine if it is vegetarian, vegan, or neither. "
+                         "Respond strictly only 'vegetarian', 'vegan', or 'neither'.")
+BATCH_CLASSIFICATION_PROMPT = ("You will receive a JSON array of items, each with an 'id' and a 'text' listing someone's favorite foods. "
+                               "For each item determine if the foods are vegetarian, vegan, or neither. "
+                               "Respond only with a JSON object of the form "
+                               '{"results": [{"id": 0, "label": "vegetarian"}]} containing exactly one entry per item, '
+                               "where label is strictly 'vegetarian', 'vegan', or 'neither'.")
+LABELS = ('vegetarian', 'vegan', 'neither')
+LABEL_PATTERN = re.compile(r"(?<![\w-])(vegetarian|vegan|neither)\b")   # Not preceded by 'non-', as in 'non-vegetarian'
+LOOKUP_CHUNK_SIZE = 500 # Number of hashes per IN (...) lookup, kept below SQLite's bound-variable limit
+CHARS_PER_TOKEN = 4 # Rough characters-per-token ratio used to estimate prompt size without a tokenizer
+ITEM_OVERHEAD_TOKENS = 8    # Estimated tokens for the JSON wrapping of each item in a batch request
+RESULT_TOKENS = 12  # Estimated completion tokens for each {"id": ..., "label": ...} entry in a batch response
+
+
+def content_hash(text):
+    """
+    Computes the content hash used to key stored classifications.
+
+    :param text: The bot response text to hash
+    :return: The SHA-256 hex digest of the UTF-8 encoded text
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def classifier_version():
+    """
+    Returns the version string of the current classifier. Changing the model or bumping the prompt
+    version in settings changes this string, which invalidates every stored classification.
+
+    :return: A string combining the classifier model and prompt version, e.g. 'gpt-3.5-turbo:1'
+    """
+    return f"{settings.CLASSIFIER_MODEL}:{settings.CLASSIFIER_PROMPT_VERSION}"
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens a text occupies in a prompt.
+
+    :param text: The text to estimate
+    :return: An approximate token count based on CHARS_PER_TOKEN
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_by_token_budget(items, budget):
+    """
+    Splits (id, text) items into consecutive chunks whose estimated prompt size fits in a token budget.
+    An item larger than the budget on its own is placed in a chunk by itself.
+
+    :param items: A list of (id, text) tuples
+    :param budget: The maximum estimated number of prompt tokens per chunk
+    :return: A generator of lists of (id, text) tuples
+    """
+    chunk = []
+    used = estimate_tokens(BATCH_CLASSIFICATION_PROMPT)
+    for item in items:
+        cost = estimate_tokens(item[1]) + ITEM_OVERHEAD_TOKENS
+        if chunk and used + cost > budget:
+            yield chunk
+            chunk = []
+            used = estimate_tokens(BATCH_CLASSIFICATION_PROMPT)
+        chunk.append(item)
+        used += cost
+    if chunk:
+        yield chunk
+
+
+def normalize_label(reply):
+    """
+    Maps a single-item classification reply to one of LABELS, accepting replies such as 'Vegetarian.' or
+    'The foods are vegan' that name exactly one label.
+
+    :param reply: The raw text returned by the model
+    :return: The label, or None if the reply names no label or several
+    """
+    labels = set(LABEL_PATTERN.findall(reply.lower()))
+    return labels.pop() if len(labels) == 1 else None
+
+
+def parse_batch_response(content, ids):
+    """
+    Parses a batch classification response, keeping only entries with a requested id and a valid label.
+
+    :param content: The raw JSON text returned by the model; ids given as numeric strings are accepted
+    :param ids: The ids that were sent in the batch
+    :return: A dictionary mapping each successfully classified id to its label; missing ids failed to parse
+    """
+    try:
+        results = json.loads(content).get("results", [])
+    except (ValueError, AttributeError):
+        return {}
+    parsed = {}
+    for entry in results if isinstance(results, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        label = str(entry.get("label", "")).strip().lower()
+        try:
+            item_id = int(entry.get("id"))  # Models often return ids as strings, e.g. "0"
+        except (TypeError, ValueError):
+            continue
+        if item_id in ids and label in LABELS:
+            parsed[item_id] = label
+    return parsed
+
+
+def batch_request(chunk):
+    """
+    Builds the chat completions arguments for classifying a chunk of items in one request.
+
+    :param chunk: A list of (id, text) tuples
+    :return: A dictionary of keyword arguments for chat.completions.create
+    """
+    return dict(
+        model=settings.CLASSIFIER_MODEL,
+        messages=[
+            {"role": "system", "content": BATCH_CLASSIFICATION_PROMPT},
+            {"role": "user", "content": json.dumps([{"id": item_id, "text": text} for item_id, text in chunk])}
+        ],
+        max_tokens=RESULT_TOKENS * len(chunk) + 20,   # Leaves room for one short result entry per item
+        temperature=0,  # Sets temperature to 0 for deterministic output
+        response_format={"type": "json_object"} # Asks the model for a parseable JSON object
+    )
+
+
+def text_request(text):
+    """
+    Builds the chat completions arguments for classifying a single bot response.
+
+    :param text: The bot response listing the user's favorite foods
+    :return: A dictionary of keyword arguments for chat.completions.create
+    """
+    return dict(
+        model=settings.CLASSIFIER_MODEL,
+        messages=[
+            {"role": "system", "content": CLASSIFICATION_PROMPT},
+            {"role": "user", "content": text}
+        ],
+        max_tokens=10,  # Limits the response to 10 tokens for efficiency
+        temperature=0   # Sets temperature to 0 for deterministic output
+    )
+
+
+async def aclassify_batch(texts, acreate=None):
+    """
+    Classifies many bot responses with as few requests as possible by packing them into JSON batches
+    sized by CLASSIFIER_BATCH_TOKEN_BUDGET, sending the batches concurrently. Items that fail to parse
+    or come back with an ambiguous label are retried in smaller batches up to CLASSIFIER_BATCH_RETRIES
+    times, then classified one by one.
+
+    :param texts: A list of bot response texts
+    :param acreate: The async chat completions callable to use, defaults to llm.acreate
+    :return: A list of classifications in the same order as texts; None where not even the single-item request
+             returned a valid label
+    """
+    acreate = acreate or llm.acreate
+    labels = {}
+    pending = list(enumerate(texts))
+    for attempt in range(settings.CLASSIFIER_BATCH_RETRIES + 1):
+        if not pending:
+            break
+        budget = max(settings.CLASSIFIER_BATCH_TOKEN_BUDGET // (2 ** attempt), 1)  # Halves the batch size on each retry
+        chunks = list(chunk_by_token_budget(pending, budget))
+        responses = await asyncio.gather(*(acreate(**batch_request(chunk)) for chunk in chunks))
+        failed = []
+        for chunk, response in zip(chunks, responses):
+            parsed = parse_batch_response(response.choices[0].message.content, {item_id for item_id, _ in chunk})
+            labels.update(parsed)
+            failed.extend(item for item in chunk if item[0] not in parsed)
+        if failed:
+            logger.info(f"Batch classification attempt {attempt + 1}: {len(failed)} items failed to parse")
+        pending = failed
+
+    # Falls back to single-item requests for items the batches never classified
+    fallback = await asyncio.gather(*(aclassify_text(text, acreate=acreate) for _, text in pending))
+    labels.update((item_id, label) for (item_id, _), label in zip(pending, fallback))
+    return [labels[item_id] for item_id in range(len(texts))]
+
+
+def classify_batch(texts, create=None):
+    """
+    Synchronous entry point for aclassify_batch(), for sync views and management commands. The batches run on
+    the process's long-lived LLM event loop, so repeated calls share one async client and its connections.
+
+    :param texts: A list of bot response texts
+    :param create: A synchronous chat completions callable to use instead of llm.acreate, run in worker threads
+    :return: A list of classifications in the same order as texts, None where the model returned no valid label
+    """
+    acreate = sync_to_async(create, thread_sensitive=False) if create else None
+    return llm.run_sync(aclassify_batch(texts, acreate))
+
+
+async def aclassify_text(text, acreate=None):
+    """
+    Classifies a single bot response as vegetarian, vegan or neither without blocking the event loop.
+
+    :param text: The bot response listing the user's favorite foods
+    :param acreate: The async chat completions callable to use, defaults to llm.acreate
+    :return: One of LABELS, or None if the model's reply names no single label
+    """
+    acreate = acreate or llm.acreate
+    response = await acreate(**text_request(text))
+    return normalize_label(response.choices[0].message.content)
+
+
+def classify_text(text, create=None):
+    """
+    Classifies a single bot response as vegetarian, vegan or neither using OpenAI.
+
+    :param text: The bot response listing the user's favorite foods
+    :param create: The chat completions callable to use, defaults to llm.create
+    :return: One of LABELS, or None if the model's reply names no single label
+    """
+    create = create or llm.create
+    response = create(**text_request(text))
+    return normalize_label(response.choices[0].message.content)
+
+
+def classify_conversations(conversations, version=None):
+    """
+    Classifies conversations with the local dietary vocabulary first. Responses without any known food terms
+    are served from the Classification table, and the LLM classifier is only called for those that are new
+    or were classified by an older version.
+
+    :param conversations: A list of Conversation objects to classify
+    :param version: The classifier version to look up and store under, defaults to classifier_version()
+    :return: A dictionary mapping each conversation id to its classification, or None if the LLM returned no valid label
+    """
+    version = version or classifier_version()
+    labels = {}
+    hashes = {}
+    for conv in conversations:
+        verdict = classify_foods(conv.bot_response).verdict
+        if verdict:
+            labels[conv.id] = verdict
+        else:
+            hashes[conv.id] = content_hash(conv.bot_response)   # Only responses without known food terms need the LLM
+
+    known = {}
+    unique_hashes = list(set(hashes.values()))
+    for start in range(0, len(unique_hashes), LOOKUP_CHUNK_SIZE):
+        # Looks up stored classifications in chunks to stay within the database's parameter limit
+        known.update(
+            Classification.objects.filter(version=version, content_hash__in=unique_hashes[start:start + LOOKUP_CHUNK_SIZE])
+            .values_list('content_hash', 'classification')
+        )
+
+    missing = {}
+    for conv in conversations:
+        # Collects each distinct unclassified response once, even if several conversations share it
+        digest = hashes.get(conv.id)
+        if digest and digest not in known and digest not in missing:
+            missing[digest] = conv.bot_response
+
+    metrics.record_cache_lookup('classification', hits=len(hashes) - len(missing), misses=len(missing))
+    if missing:
+        logger.info(f"Classifying {len(missing)} new or stale responses ({len(known)} served from store)")
+    created = []
+    for digest, label in zip(missing, classify_batch(list(missing.values()))):
+        known[digest] = label
+        if label:   # Replies without a valid label are not stored, so they are classified again next time
+            created.append(Classification(content_hash=digest, version=version, classification=label))
+    Classification.objects.bulk_create(created, ignore_conflicts=True)   # Ignores rows stored concurrently by another worker
+
+    labels.update((conv_id, known[digest]) for conv_id, digest in hashes.items())
+    return labels
@@ -0,0 +1,121 @@
+import re
+from typing import NamedTuple
+
+# Foods that make a list neither vegetarian nor vegan
+MEAT_TERMS = [
+    "chicken", "beef", "pork", "fish", "shrimp", "prawn", "lamb", "mutton", "turkey", "duck", "goose", "venison",
+    "goat", "rabbit", "veal", "bacon", "sausage", "ham", "hamburger", "cheeseburger", "pepperoni", "salami",
+    "prosciutto", "chorizo", "steak", "crab", "lobster", "squid", "calamari", "octopus", "clam", "mussel", "oyster",
+    "scallop", "anchovy", "sardine", "salmon", "tuna", "cod", "trout", "gelatin", "broth", "stock", "lard", "suet",
+    "tallow", "meat", "meatball", "seafood", "poultry", "game", "jerky",
+]
+# Animal products that keep a list vegetarian but not vegan
+ANIMAL_PRODUCT_TERMS = [
+    "egg", "dairy", "cheese", "milk", "butter", "honey", "cream", "ice cream", "yogurt", "yoghurt", "ghee", "whey",
+    "mayonnaise", "gelato", "paneer", "feta", "mozzarella", "parmesan", "parm", "parmigiana", "cheddar", "ricotta", "custard", "omelette",
+    "omelet", "pizza",
+]
+# Plant foods, including plant-based variants of the terms above, which win because longer matches are preferred
+PLANT_TERMS = [
+    "tofu", "tempeh", "seitan", "salad", "lentil", "bean", "chickpea", "hummus", "falafel", "edamame", "pasta",
+    "rice", "quinoa", "oats", "oatmeal", "bulgur", "barley", "millet", "couscous", "buckwheat", "bread", "noodle",
+    "tortilla", "pita", "potato", "sweet potato", "vegetable", "broccoli", "carrot", "spinach", "kale", "avocado",
+    "mushroom", "cucumber", "tomato", "onion", "garlic", "pepper", "corn", "pea", "cabbage", "eggplant", "zucchini",
+    "cauliflower", "brussels sprouts", "asparagus", "fruit", "apple", "banana", "orange", "berry", "blueberry",
+    "strawberry", "cranberry", "grape", "melon", "cherry", "mango", "papaya", "pineapple", "kiwi", "coconut", "fig",
+    "raisin", "almond", "cashew", "walnut", "peanut", "nut", "seed", "chia", "flax", "peanut butter",
+    "almond butter", "soy milk", "almond milk", "oat milk", "coconut milk", "vegetable broth", "vegetable stock",
+]
+
+VEGAN = "vegan"
+VEGETARIAN = "vegetarian"
+NEITHER = "neither"
+
+
+class DietaryVerdict(NamedTuple):
+    """
+    The result of matching a text against the dietary vocabulary: a verdict of 'vegan', 'vegetarian'
+    or 'neither', or None when the text contains no known food terms, plus the matched terms in order.
+    """
+    verdict: str | None
+    terms: tuple
+
+
+def _forms(term):
+    """
+    Generates the singular and plural spellings of a term that the matcher should recognise.
+
+    :param term: A vocabulary term in singular form
+    :return: A set of lower-case spellings
+    """
+    forms = {term, term + "s", term + "es"}
+    if term.endswith("y") and term[-2:-1] not in "aeiou":
+        forms.add(term[:-1] + "ies")    # e.g. berry -> berries, anchovy -> anchovies
+    return forms
+
+
+def _build_vocabulary():
+    vocabulary = {}
+    for category, terms in ((VEGAN, PLANT_TERMS), (VEGETARIAN, ANIMAL_PRODUCT_TERMS), (NEITHER, MEAT_TERMS)):
+        for term in terms:
+            for form in _forms(term):
+                vocabulary[form] = (term, category)
+    return vocabulary
+
+
+def _trie_pattern(node):
+    """
+    Converts a character trie into a regex fragment whose alternations share common prefixes, which Python's
+    regex engine matches far faster than a flat alternation of hundreds of words. Optional suffix groups are
+    greedy, so the longest spelling is tried first and 'peanut butter' wins over 'peanut'.
+
+    :param node: A trie node mapping characters to child nodes, with '' marking the end of a word
+    :return: A regex fragment matching every word in the trie
+    """
+    branches = [(r"\s+" if char == " " else re.escape(char)) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:%s)" % "|".join(branches)
+    if "" in node:
+        pattern = "(?:%s)?" % pattern
+    return pattern
+
+
+def _build_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(r"\b%s\b" % _trie_pattern(trie))   # Matched against lower-cased text, which is faster than re.IGNORECASE
+
+
+VOCABULARY = _build_vocabulary()    # Maps every recognised spelling to its (canonical term, category)
+FOOD_PATTERN = _build_pattern(VOCABULARY)   # One word-boundary regex over the whole vocabulary, built once at import
+
+
+def classify_foods(text):
+    """
+    Classifies a text listing foods by matching it against the dietary vocabulary in a single regex pass.
+    Any meat term makes the text 'neither', otherwise any animal product makes it 'vegetarian', otherwise
+    known plant foods make it 'vegan'.
+
+    :param text: A free-form text such as a bot response or a comma-separated food list
+    :return: A DietaryVerdict; its verdict is None when no known food terms were found
+    """
+    terms = []
+    categories = set()
+    for match in FOOD_PATTERN.finditer(text.lower()):
+        term, category = VOCABULARY[" ".join(match.group(0).split())]
+        if term not in terms:
+            terms.append(term)
+        categories.add(category)
+    if NEITHER in categories:
+        return DietaryVerdict(NEITHER, tuple(terms))
+    if VEGETARIAN in categories:
+        return DietaryVerdict(VEGETARIAN, tuple(terms))
+    if VEGAN in categories:
+        return DietaryVerdict(VEGAN, tuple(terms))
+    return DietaryVerdict(None, ())
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import llm
+from .models import SimulationJob, SimulationResult
+
+logger = logging.getLogger(__name__)
+
+SIMULATION_QUESTION = "What are your top 3 favorite foods?"
+
+
+def enqueue_simulation(total):
+    """
+    Creates a queued simulation job for a background worker to pick up.
+
+    :param total: The number of conversations to simulate
+    :return: The created SimulationJob
+    """
+    return SimulationJob.objects.create(total=total)
+
+
+def claim_next_job():
+    """
+    Atomically claims the oldest queued job. The conditional update means two workers can never claim the
+    same job, without relying on SELECT ... FOR UPDATE, which SQLite does not support.
+
+    :return: The claimed SimulationJob, now running, or None if the queue is empty
+    """
+    for job in SimulationJob.objects.filter(status=SimulationJob.QUEUED).order_by('created_at', 'id')[:10]:
+        claimed = SimulationJob.objects.filter(id=job.id, status=SimulationJob.QUEUED).update(
+            status=SimulationJob.RUNNING, started_at=job.started_at or timezone.now(), error="", updated_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Puts running jobs whose worker stopped sending heartbeats back in the queue. They resume from the
+    results already stored.
+
+    :param stale_after: Seconds without a heartbeat after which a running job is considered abandoned
+    :return: The number of requeued jobs
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return SimulationJob.objects.filter(status=SimulationJob.RUNNING, updated_at__lt=cutoff).update(status=SimulationJob.QUEUED)
+
+
+async def simulate_answer():
+    """
+    Asks the LLM the simulation question once.
+
+    :return: The AI-generated answer
+    """
+    response = await llm.acreate(
+        model=settings.SIMULATION_MODEL,
+        messages=[{"role": "user", "content": SIMULATION_QUESTION}],
+        max_tokens=100
+    )
+    return response.choices[0].message.content.strip()
+
+
+def store_results(job_id, first_iteration, answers):
+    """
+    Stores a batch of results and advances the job's progress counter in one transaction.
+    """
+    with transaction.atomic():
+        SimulationResult.objects.bulk_create([
+            SimulationResult(job_id=job_id, iteration=first_iteration + offset, question=SIMULATION_QUESTION, answer=answer)
+            for offset, answer in enumerate(answers)
+        ])
+        SimulationJob.objects.filter(id=job_id).update(completed=F('completed') + len(answers), updated_at=timezone.now())
+
+
+def finish_job(job_id, status, error=""):
+    SimulationJob.objects.filter(id=job_id).update(status=status, error=error, finished_at=timezone.now())
+
+
+async def run_simulation_job(job, concurrency, batch_size=10):
+    """
+    Runs a claimed job with at most `concurrency` LLM requests in flight (also bounded by LLM_CONCURRENCY and
+    the shared rate limiter), storing results in small batches so progress is visible while it runs.
+    A resumed job only simulates the conversations it has not stored yet.
+
+    :param job: The claimed SimulationJob
+    :param concurrency: The maximum number of simulated conversations in flight
+    :param batch_size: The number of results stored per database write
+    """
+    next_iteration = job.completed + 1
+    remaining = job.total - job.completed
+    pending = []
+    lock = asyncio.Lock()
+
+    async def flush():
+        nonlocal next_iteration, pending
+        if pending:
+            answers, pending = pending, []
+            first_iteration, next_iteration = next_iteration, next_iteration + len(answers)
+            await sync_to_async(store_results)(job.id, first_iteration, answers)
+
+    async def worker(count):
+        for _ in range(count):
+            answer = await simulate_answer()
+            async with lock:
+                pending.append(answer)
+                if len(pending) >= batch_size:
+                    await flush()
+
+    counts = [remaining // concurrency + (1 if index < remaining % concurrency else 0) for index in range(concurrency)]
+    tasks = [asyncio.create_task(worker(count)) for count in counts if count]
+    try:
+        await asyncio.gather(*tasks)
+        async with lock:
+            await flush()
+    except Exception as error:
+        logger.exception(f"Simulation job {job.id} failed")
+        for task in tasks:
+            task.cancel()   # Stops the other workers before the job is marked failed
+        await asyncio.gather(*tasks, return_exceptions=True)
+        async with lock:
+            await flush()   # Keeps the results that did arrive
+        await sync_to_async(finish_job)(job.id, SimulationJob.FAILED, str(error))
+        return
+    await sync_to_async(finish_job)(job.id, SimulationJob.COMPLETED)
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+
+import openai
+from django.conf import settings
+
+from . import metrics
+from .backends import build_backend, make_completion
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    A process-wide token-bucket rate limiter shared by every LLM call, in sync and async code alike.
+    Each call reserves a token and waits until the bucket has refilled enough to cover it, and
+    a 429 response pauses the whole bucket for the server's Retry-After delay.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate    # Tokens added per second; 0 or less disables rate limiting
+        self.capacity = capacity    # Maximum number of tokens, i.e. the allowed burst size
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0    # Monotonic time before which no call may start, set from Retry-After
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token from the bucket, going into debt if it is empty.
+
+        :return: The number of seconds the caller must wait before making its request
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.rate <= 0:
+                return max(self.blocked_until - now, 0.0)
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now, 0.0)
+
+    def pause(self, seconds):
+        """
+        Blocks every caller for the given number of seconds, e.g. after a 429 response.
+
+        :param seconds: How long to stop issuing requests
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    async def aacquire(self):
+        await asyncio.sleep(self.reserve())
+
+
+rate_limiter = TokenBucket(settings.LLM_RATE_LIMIT, settings.LLM_RATE_BURST)
+_sync_semaphore = threading.BoundedSemaphore(settings.LLM_CONCURRENCY)
+_loop_semaphores = weakref.WeakKeyDictionary()  # Event loop -> asyncio.Semaphore, which is bound to the loop that uses it
+_backend = None
+_sync_loop = None   # (pid, event loop) running in a background thread, see sync_loop()
+_sync_loop_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide LLM backend, building it from settings on first use.
+
+    :return: An LLMBackend
+    """
+    global _backend
+    if _backend is None:
+        _backend = build_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replaces the process-wide LLM backend, e.g. with a StubBackend in benchmarks.
+
+    :param backend: The LLMBackend to use, or None to rebuild it from settings on next use
+    """
+    global _backend
+    _backend = backend
+
+
+def get_semaphore():
+    """
+    Returns the concurrency semaphore for the running event loop.
+
+    :return: An asyncio.Semaphore allowing LLM_CONCURRENCY calls in flight
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _loop_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _loop_semaphores[loop] = asyncio.Semaphore(settings.LLM_CONCURRENCY)
+    return semaphore
+
+
+def sync_loop():
+    """
+    Returns the process's long-lived event loop for sync callers, running in a daemon thread and started on
+    first use. Running every sync call on the same loop lets it reuse that loop's async client and connection
+    pool, where async_to_sync() outside ASGI would build a new loop, and so a new client, for each call.
+    A forked process starts its own loop, since the parent's thread does not survive the fork.
+
+    :return: The running asyncio event loop
+    """
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None or _sync_loop[0] != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-sync-loop", daemon=True).start()
+            _sync_loop = (os.getpid(), loop)
+        return _sync_loop[1]
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine on sync_loop() and waits for its result. The caller's context variables, such as
+    the request metrics, are carried over to the coroutine.
+
+    :param coroutine: The coroutine to run; it must not be called from sync_loop() itself
+    :return: The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, sync_loop()).result()
+
+
+# Errors worth retrying besides 429s: connection failures and timeouts, and 5xx server errors
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+
+def retry_delay(error, attempt):
+    """
+    Determines how long to wait after a rate-limit or transient error, preferring the server's Retry-After header.
+
+    :param error: The openai.RateLimitError or transient error that was raised
+    :param attempt: The zero-based attempt number, used for exponential backoff when no header is present
+    :return: The delay in seconds
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        return float(headers['retry-after'])
+    except (KeyError, TypeError, ValueError):
+        return min(2 ** attempt, 30)
+
+
+def estimated_usage(kwargs, text):
+    """
+    Estimates the usage of a streamed completion, which does not report one.
+
+    :param kwargs: The chat completions request
+    :param text: The streamed completion text
+    :return: A CompletionUsage with estimated token counts
+    """
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in kwargs.get("messages", [])) // 4
+    return make_completion(text, kwargs.get("model", ""), prompt_tokens).usage
+
+
+def outcome(error):
+    return "rate_limited" if isinstance(error, openai.RateLimitError) else "error"
+
+
+def backoff(error, attempt):
+    """
+    Decides whether a failed attempt is retried. A 429 pauses the shared rate limiter for the Retry-After
+    delay, so every call in the process backs off; other transient errors only delay this call.
+
+    :param error: The exception raised by the backend
+    :param attempt: The zero-based attempt number
+    :return: The seconds the caller should sleep before retrying, or None if the error is raised
+    """
+    if attempt == settings.LLM_MAX_RETRIES or not isinstance(error, (openai.RateLimitError,) + TRANSIENT_ERRORS):
+        return None
+    delay = retry_delay(error, attempt)
+    if isinstance(error, openai.RateLimitError):
+        logger.warning(f"LLM rate limited, retrying in {delay:.1f}s")
+        rate_limiter.pause(delay)
+        return 0
+    logger.warning(f"LLM request failed ({type(error).__name__}), retrying in {delay:.1f}s")
+    return delay
+
+
+async def awarm_up():
+    """
+    Builds the backend and the async client of the running event loop, opening a connection ahead of the first
+    request. A failure is logged rather than raised, so an unreachable API never stops a worker from starting.
+    """
+    try:
+        await get_backend().awarm_up()
+    except Exception:
+        logger.warning("Failed to warm up the async LLM client", exc_info=True)
+
+
+def create(**kwargs):
+    """
+    Calls the configured LLM backend synchronously, bounded by LLM_CONCURRENCY and the shared rate limiter.
+    429 responses pause the rate limiter for the Retry-After delay, and together with connection errors,
+    timeouts and 5xx responses are retried up to LLM_MAX_RETRIES times.
+    Every attempt's duration, outcome and token usage is recorded in chatbot.metrics.
+
+    :param kwargs: Arguments passed through to chat.completions.create
+    :return: The chat completion
+    """
+    with _sync_semaphore:
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                completion = get_backend().complete(**kwargs)
+            except Exception as error:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, outcome(error))
+                delay = backoff(error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, "ok", completion.usage)
+                return completion
+
+
+async def acreate(**kwargs):
+    """
+    Async version of create(), for async views and asyncio fan-out. Many calls can be awaited at once;
+    at most LLM_CONCURRENCY per event loop are in flight, and all of them share the rate limiter.
+
+    :param kwargs: Arguments passed through to chat.completions.create
+    :return: The chat completion
+    """
+    async with get_semaphore():
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            await rate_limiter.aacquire()
+            start = time.perf_counter()
+            try:
+                completion = await get_backend().acomplete(**kwargs)
+            except Exception as error:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, outcome(error))
+                delay = backoff(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, "ok", completion.usage)
+                return completion
+
+
+async def astream(**kwargs):
+    """
+    Streams a chat completion, yielding the text of each token delta as it arrives. The call holds its
+    concurrency slot until the stream is exhausted and shares the rate limiter with every other call;
+    a failed attempt is retried only if no token has been yielded yet.
+
+    :param kwargs: Arguments passed through to chat.completions.create
+    :return: An async generator of text deltas
+    """
+    async with get_semaphore():
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            await rate_limiter.aacquire()
+            tokens = []
+            start = time.perf_counter()
+            try:
+                async for token in get_backend().astream(**kwargs):
+                    tokens.append(token)
+                    yield token
+            except Exception as error:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, outcome(error),
+                                        estimated_usage(kwargs, "".join(tokens)) if tokens else None)
+                delay = None if tokens else backoff(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                metrics.record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, "ok",
+                                        estimated_usage(kwargs, "".join(tokens)))
+                return
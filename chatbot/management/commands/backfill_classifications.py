@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.classification import classifier_version, classify_conversations
+from chatbot.models import Classification, Conversation
+
+
+class Command(BaseCommand):
+    """
+    Management command that classifies every stored conversation not yet classified by the current
+    classifier version, so the vegetarian users API can serve them straight from the Classification table.
+    """
+    help = "Backfills the Classification table for the current classifier version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of conversations read and classified per batch")
+        parser.add_argument('--prune', action='store_true', help="Delete classifications stored by other classifier versions")
+
+    def handle(self, *args, **options):
+        version = classifier_version()
+        batch_size = options['batch_size']
+        batch = []
+        processed = 0
+        for conv in Conversation.objects.only('id', 'bot_response').iterator(chunk_size=batch_size):
+            # Streams conversations in chunks so memory stays bounded for large tables
+            batch.append(conv)
+            if len(batch) >= batch_size:
+                classify_conversations(batch, version=version)
+                processed += len(batch)
+                batch = []
+                self.stdout.write(f"Processed {processed} conversations")
+        if batch:
+            classify_conversations(batch, version=version)
+            processed += len(batch)
+
+        if options['prune']:
+            deleted, _ = Classification.objects.exclude(version=version).delete()
+            self.stdout.write(f"Pruned {deleted} stale classifications")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled classifications for {processed} conversations (version {version})"))
@@ -0,0 +1,43 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatbot.models import ConversationFood, Food, normalize_food_name
+from chatbot.stats import rebuild
+
+
+class Command(BaseCommand):
+    """
+    Management command that renames stored foods to their canonical vocabulary names, merging the variants of
+    a food, e.g. 'Sausage' and 'sausages: smoky', into one Food row. Foods saved before the vocabulary was
+    introduced were stored as extracted, so per-food statistics counted the variants separately.
+    """
+    help = "Merges stored food name variants into their canonical vocabulary names."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list the foods that would be renamed or merged")
+
+    def handle(self, *args, **options):
+        variants = defaultdict(list)    # Canonical name -> stored foods to move to it
+        for food in Food.objects.only('id', 'name').iterator():
+            canonical = normalize_food_name(food.name)
+            if canonical != food.name:
+                variants[canonical].append(food)
+        for canonical, foods in sorted(variants.items()):
+            self.stdout.write(f"{', '.join(repr(food.name) for food in foods)} -> {canonical!r}")
+        if options['dry_run'] or not variants:
+            self.stdout.write(self.style.SUCCESS(f"{sum(map(len, variants.values()))} foods to canonicalize"))
+            return
+
+        with transaction.atomic():
+            for canonical, foods in variants.items():
+                target, _ = Food.objects.get_or_create(name=canonical)
+                # A queryset update sends no signals; the statistics are rebuilt below
+                ConversationFood.objects.filter(food__in=foods).update(food=target)
+                Food.objects.filter(id__in=[food.id for food in foods]).delete()
+            counters = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Canonicalized {sum(map(len, variants.values()))} foods into {len(variants)} names "
+            f"and rebuilt {counters} statistics counters"
+        ))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.transfer import FORMATS, detect_format, iter_conversation_rows, write_rows
+
+
+class Command(BaseCommand):
+    """
+    Management command streaming conversations, with their foods, to an NDJSON or CSV file. Rows are read with
+    a chunked iterator and written one at a time, so memory use does not depend on the size of the table.
+    """
+    help = "Exports conversations to NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="The file to write, or '-' for standard output")
+        parser.add_argument('--format', choices=FORMATS, help="The file format, detected from the extension by default")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Conversations read per database round-trip")
+        parser.add_argument('--after-id', type=int, default=0, help="Only export conversations with a greater id, e.g. for incremental exports")
+
+    def handle(self, *args, **options):
+        try:
+            format = detect_format(options['output'], options['format'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        rows = iter_conversation_rows(options['chunk_size'], options['after_id'])
+        if options['output'] == '-':
+            count = write_rows(rows, sys.stdout, format)
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                count = write_rows(rows, f, format)
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} conversations"))
@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.models import Conversation
+from chatbot.transfer import FORMATS, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    """
+    Management command streaming conversations from an NDJSON or CSV file (as written by export_conversations)
+    into the database with batched inserts. Only one batch is held in memory, and an interrupted import
+    continues from the last committed line with --skip.
+    """
+    help = "Imports conversations from NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="The file to read, or '-' for standard input")
+        parser.add_argument('--format', choices=FORMATS, help="The file format, detected from the extension by default")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Conversations inserted per transaction")
+        parser.add_argument('--skip', type=int, default=0, help="Skip rows up to this line number, to resume an interrupted import")
+
+    def handle(self, *args, **options):
+        try:
+            format = detect_format(options['input'], options['format'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        if options['input'] == '-':
+            self.load(sys.stdin, format, options)
+        else:
+            with open(options['input'], encoding='utf-8', newline='') as f:
+                self.load(f, format, options)
+
+    def load(self, stream, format, options):
+        batch, imported, committed_line = [], 0, options['skip']
+        try:
+            for number, foods, fields in read_rows(stream, format):
+                if number <= options['skip']:
+                    continue
+                batch.append((foods, fields))
+                if len(batch) >= options['batch_size']:
+                    imported += self.flush(batch, number)
+                    batch, committed_line = [], number
+        except ValueError as error:
+            raise CommandError(f"{error}. {imported} conversations were imported; fix the row and resume with --skip {committed_line}")
+        if batch:
+            imported += self.flush(batch, number)
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} conversations"))
+
+    def flush(self, batch, last_line):
+        Conversation.objects.bulk_create_with_foods(batch)
+        self.stdout.write(f"Imported up to line {last_line}")
+        return len(batch)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.search import missing_search_objects, repair_search_index
+
+
+class Command(BaseCommand):
+    """
+    Management command that recreates the objects of the conversation search index created by migration 0008
+    and reindexes the conversations, e.g. after a migration that rebuilt the conversation table dropped the
+    SQLite triggers keeping the index in sync.
+    """
+    help = "Recreates and rebuilds, or with --check verifies, the conversation full-text search index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Only list the missing search index objects")
+        parser.add_argument('--database', default='default', help="The database alias to use")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            missing = missing_search_objects(options['database'])
+            if missing:
+                raise CommandError(f"The search index is missing {', '.join(missing)}; run rebuild_search_index to fix it")
+            self.stdout.write(self.style.SUCCESS("The search index is complete"))
+            return
+        recreated = repair_search_index(options['database'], rebuild=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Recreated {', '.join(recreated) if recreated else 'no missing objects'} and rebuilt the search index"
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.stats import compute_counts, rebuild, stored_counts
+
+
+class Command(BaseCommand):
+    """
+    Management command that recomputes the aggregate statistics from the conversations, either to check the
+    incrementally maintained counters or to replace them, e.g. after bulk edits that bypass model signals.
+    """
+    help = "Rebuilds, or with --check verifies, the materialized dietary statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Only compare the stored counters with recomputed ones")
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            stored = rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {stored} statistics counters"))
+            return
+        expected, stored = compute_counts(), stored_counts()
+        mismatches = sorted(key for key in expected.keys() | stored.keys() if expected[key] != stored[key])
+        for dimension, key in mismatches:
+            self.stdout.write(f"{dimension} {key!r}: stored {stored[dimension, key]}, expected {expected[dimension, key]}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} statistics counters are out of date; run rebuild_stats to fix them")
+        self.stdout.write(self.style.SUCCESS(f"All {len(expected)} statistics counters are consistent"))
@@ -0,0 +1,156 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from chatbot import llm
+from chatbot.classification import classifier_version, classify_conversations
+from chatbot.dietary import classify_foods
+from chatbot.models import Conversation
+
+
+def init_worker(rate_limit):
+    """
+    Runs in each pool process. The LLM rate limit is split between processes, since each has its own limiter.
+    """
+    llm.rate_limiter.rate = rate_limit
+
+
+def ready():
+    return True
+
+
+def reclassify_range(first_id, last_id, use_llm, version):
+    """
+    Reclassifies the conversations with ids in [first_id, last_id] and stores changed is_vegetarian flags.
+    With use_llm, responses the local dietary rules cannot decide are classified by classify_conversations,
+    which serves stored classifications first; otherwise they are left unchanged.
+
+    :return: A (last_id, processed, changed, undecided) tuple
+    """
+    conversations = list(Conversation.objects.filter(id__gte=first_id, id__lte=last_id).only('id', 'bot_response', 'is_vegetarian'))
+    if use_llm:
+        labels = classify_conversations(conversations, version=version)
+    else:
+        labels = {conv.id: classify_foods(conv.bot_response).verdict for conv in conversations}
+    changed, undecided = [], 0
+    for conv in conversations:
+        label = labels.get(conv.id)
+        if label is None:
+            undecided += 1
+            continue
+        is_vegetarian = label in ('vegetarian', 'vegan')
+        if conv.is_vegetarian != is_vegetarian:
+            conv.is_vegetarian = is_vegetarian
+            changed.append(conv)
+    Conversation.objects.bulk_update(changed, ['is_vegetarian'], batch_size=500)
+    return last_id, len(conversations), len(changed), undecided
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Writes the checkpoint atomically, so an interruption never leaves a half-written file.
+    """
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class Command(BaseCommand):
+    """
+    Management command recomputing the is_vegetarian flag of every conversation across a pool of processes.
+    Conversation ids are streamed in id-range batches, so only the batches in flight are held in memory.
+    Progress is checkpointed after every batch up to which all batches are done, so --resume continues
+    an interrupted run without redoing finished work.
+    """
+    help = "Reclassifies conversations with the local dietary rules, and optionally the LLM, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Conversations per batch sent to a worker")
+        parser.add_argument('--llm', action='store_true', help="Classify responses without known food terms with the LLM")
+        parser.add_argument('--checkpoint', default='reclassify.checkpoint.json', help="Where progress is recorded")
+        parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint of an interrupted run")
+
+    def handle(self, *args, **options):
+        version = classifier_version()
+        after_id = 0
+        if options['resume']:
+            checkpoint = load_checkpoint(options['checkpoint'])
+            if checkpoint is None:
+                raise CommandError(f"No checkpoint found at {options['checkpoint']}")
+            if checkpoint['llm'] != options['llm']:
+                raise CommandError("The checkpoint was written by a run with a different --llm setting")
+            after_id = checkpoint['last_id']
+            self.stdout.write(f"Resuming after conversation {after_id}")
+
+        total = Conversation.objects.filter(id__gt=after_id).count()
+        workers = max(options['workers'], 1)
+        rate_limit = settings.LLM_RATE_LIMIT / workers
+        processed = changed = undecided = 0
+        started = time.monotonic()
+        in_flight, order, done = set(), deque(), set()   # Futures, batch last ids in submission order, finished last ids
+
+        connections.close_all()     # Forked workers open their own connections instead of sharing the parent's
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(rate_limit,)) as pool:
+            pool.submit(ready).result()     # Forks every worker before the parent opens the cursor reading the ids
+            def collect(block):
+                nonlocal processed, changed, undecided, after_id
+                if block:
+                    finished = wait(in_flight, return_when=FIRST_COMPLETED).done
+                else:
+                    finished = {future for future in in_flight if future.done()}
+                for future in finished:
+                    in_flight.discard(future)
+                    last_id, batch_processed, batch_changed, batch_undecided = future.result()
+                    done.add(last_id)
+                    processed += batch_processed
+                    changed += batch_changed
+                    undecided += batch_undecided
+                while order and order[0] in done:   # The checkpoint only advances past contiguous finished batches
+                    after_id = order.popleft()
+                    done.discard(after_id)
+                if finished:
+                    save_checkpoint(options['checkpoint'], {"last_id": after_id, "llm": options['llm'], "version": version})
+                    rate = processed / (time.monotonic() - started)
+                    self.stdout.write(f"Reclassified {processed}/{total} conversations ({rate:.0f}/s), "
+                                      f"{changed} changed, {undecided} undecided")
+
+            ids = Conversation.objects.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)
+            batch = []
+            for conv_id in ids.iterator(chunk_size=options['batch_size']):
+                batch.append(conv_id)
+                if len(batch) == options['batch_size']:
+                    self.submit(pool, in_flight, order, batch, options['llm'], version)
+                    batch = []
+                    while len(in_flight) >= workers * 2:    # Bounds the batches queued ahead of the workers
+                        collect(block=True)
+                    collect(block=False)
+            if batch:
+                self.submit(pool, in_flight, order, batch, options['llm'], version)
+            while in_flight:
+                collect(block=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reclassified {processed} conversations: {changed} changed, {undecided} left undecided"
+            + (" (run with --llm to classify them)" if undecided and not options['llm'] else "")
+        ))
+
+    def submit(self, pool, in_flight, order, batch, use_llm, version):
+        in_flight.add(pool.submit(reclassify_range, batch[0], batch[-1], use_llm, version))
+        order.append(batch[-1])
@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.jobs import claim_next_job, requeue_stale_jobs, run_simulation_job
+
+
+class Command(BaseCommand):
+    """
+    Management command running the background worker for /simulate/ jobs. It claims queued jobs one at a time
+    and runs each with bounded parallelism, so long batches never tie up a web worker.
+    """
+    help = "Runs queued simulation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.LLM_CONCURRENCY, help="Conversations in flight per job")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--stale-after', type=float, default=300.0, help="Seconds without progress after which a running job is requeued")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} abandoned jobs")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                requeue_stale_jobs(options['stale_after'])
+                continue
+            self.stdout.write(f"Running simulation job {job.id} ({job.completed}/{job.total} done)")
+            asyncio.run(run_simulation_job(job, options['concurrency']))
+            job.refresh_from_db()
+            self.stdout.write(f"Simulation job {job.id} {job.status} with {job.completed}/{job.total} results")
@@ -0,0 +1,140 @@
+import logging
+
+from django.conf import settings
+
+from . import llm
+from .classification import estimate_tokens
+from .parsing import is_known_food, parse_foods, split_foods
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = 'chatbot_memory'
+SYSTEM_PROMPT = ("You are a friendly chatbot. Ask the user: 'What are your top 3 favorite foods?' "
+                 "If they respond, thank them and list their foods (e.g., '1. food1, 2. food2, 3. food3'). "
+                 "If they don't provide foods or the list is incomplete, gently prompt again for the missing ones, "
+                 "remembering the foods they already gave.")
+SUMMARY_PROMPT = ("Summarize this conversation between a user and a food chatbot in at most three sentences. "
+                  "Keep every food the user mentioned and whether their list of 3 favorite foods is complete.")
+MAX_PENDING_INPUTS = 3  # A list of three foods is given in at most three pieces
+
+
+def is_food_piece(user_input):
+    """
+    :param user_input: The raw user input
+    :return: Whether the input is part of a food list, i.e. one or two items that are all known foods
+    """
+    items = split_foods(user_input)
+    return 0 < len(items) < 3 and "?" not in user_input and all(is_known_food(item) for item in items)
+
+
+class ConversationMemory:
+    """
+    The compact history of one chat session: a summary of older turns, the recent (user, bot) turns that fit
+    in CHAT_MEMORY_TOKEN_WINDOW, and the inputs given since the last complete food list. Once the turns outgrow
+    the window the oldest are folded into the summary, so prompts stay bounded however long a session lasts.
+    It is stored in the user's session as plain lists.
+    """
+    def __init__(self, summary="", turns=None, pending=None):
+        self.summary = summary
+        self.turns = turns or []    # [user_input, bot_response] pairs, oldest first
+        self.pending = pending or []    # Food pieces that did not complete a list yet
+
+    @classmethod
+    def from_session(cls, data):
+        data = data or {}
+        return cls(data.get("summary", ""), data.get("turns"), data.get("pending"))
+
+    def to_session(self):
+        return {"summary": self.summary, "turns": self.turns, "pending": self.pending}
+
+    @property
+    def is_empty(self):
+        return not self.summary and not self.turns
+
+    def messages(self, user_input):
+        """
+        Builds the chat messages for the next turn: the system prompt, the summary of older turns, the recent
+        turns and the user's input.
+
+        :param user_input: The raw user input
+        :return: A list of chat messages
+        """
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        for user_turn, bot_turn in self.turns:
+            messages.append({"role": "user", "content": user_turn})
+            messages.append({"role": "assistant", "content": bot_turn})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def parse_pieces(self, user_input):
+        """
+        Parses a list of foods given in pieces over several turns, e.g. 'pizza' then 'pasta and salad', from
+        the fewest recent pending food pieces that, with this one, make up exactly 3 known foods.
+
+        :param user_input: The raw user input
+        :return: A (foods, text) tuple with the joined inputs as text, or (None, user_input)
+        """
+        for count in range(1, len(self.pending) + 1):
+            pieces = self.pending[-count:] + [user_input]
+            foods = parse_foods(", ".join(pieces))
+            if foods:
+                return foods, "\n".join(pieces)
+        return None, user_input
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(user_turn) + estimate_tokens(bot_turn) for user_turn, bot_turn in self.turns)
+
+    async def aremember(self, user_input, bot_response, completed):
+        """
+        Adds a turn, summarizing the oldest turns once the token window is full.
+
+        :param user_input: The raw user input
+        :param bot_response: The response shown to the user
+        :param completed: Whether the turn completed a food list, which clears the pending food pieces
+        """
+        self.turns.append([user_input, bot_response])
+        if completed:
+            self.pending = []
+        elif is_food_piece(user_input):     # Small talk is never carried over into a food list
+            self.pending = (self.pending + [user_input])[-MAX_PENDING_INPUTS:]
+        overflow = []
+        while len(self.turns) > 1 and self.tokens() > settings.CHAT_MEMORY_TOKEN_WINDOW:
+            overflow.append(self.turns.pop(0))
+        if overflow:
+            self.summary = await self.asummarize(overflow)
+
+    async def asummarize(self, turns):
+        """
+        Folds turns into the summary with one short LLM call. If the call fails the turns are dropped and the
+        previous summary is kept, which still bounds the prompt.
+
+        :param turns: The [user_input, bot_response] pairs leaving the window
+        :return: The new summary
+        """
+        transcript = "\n".join(f"User: {user_turn}\nBot: {bot_turn}" for user_turn, bot_turn in turns)
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n{transcript}"
+        try:
+            response = await llm.acreate(
+                model=settings.CHATBOT_MODEL,
+                messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+                max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS
+            )
+        except Exception:
+            logger.warning("Failed to summarize the conversation history, dropping the oldest turns", exc_info=True)
+            return self.summary
+        return response.choices[0].message.content.strip()
+
+
+async def aload_memory(request):
+    """
+    :param request: The HTTP request object
+    :return: The session's ConversationMemory
+    """
+    return ConversationMemory.from_session(await request.session.aget(SESSION_KEY))
+
+
+async def asave_memory(request, memory):
+    await request.session.aset(SESSION_KEY, memory.to_session())
@@ -0,0 +1,263 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Metric:
+    """
+    A labelled metric in the Prometheus text exposition format. Samples are kept per process, so with several
+    workers each worker serves its own values and Prometheus aggregates them across scrape targets.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}    # Label values tuple -> sample state
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+
+    def total(self):
+        """
+        :return: The counter's value summed over all its labels
+        """
+        with self.lock:
+            return sum(self.values.values())
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        lines = []
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {cumulative}")
+        return lines
+
+    def totals(self):
+        """
+        :return: A (count, sum) tuple of the observations over all labels
+        """
+        with self.lock:
+            return sum(sum(counts) for counts, _ in self.values.values()), sum(total for _, total in self.values.values())
+
+
+REQUESTS = Counter("chatbot_http_requests_total", "HTTP requests by view, method and status.", ["view", "method", "status"])
+REQUEST_DURATION = Histogram("chatbot_http_request_duration_seconds", "Wall time of HTTP requests, until the last byte of streamed responses.", ["view", "method"])
+REQUEST_PHASE_DURATION = Histogram("chatbot_http_request_phase_duration_seconds", "Time spent per request in LLM calls, database queries and serialization. Concurrent LLM calls are summed.", ["view", "phase"])
+REQUEST_QUERIES = Histogram("chatbot_http_request_db_queries", "Database queries per HTTP request.", ["view"], buckets=QUERY_BUCKETS)
+LLM_REQUESTS = Counter("chatbot_llm_requests_total", "LLM calls by model, calling view and outcome.", ["model", "view", "outcome"])
+LLM_DURATION = Histogram("chatbot_llm_request_duration_seconds", "Duration of LLM calls, excluding rate limiter waits.", ["model"])
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "LLM tokens by model, calling view and kind (prompt or completion).", ["model", "view", "kind"])
+LLM_COST = Counter("chatbot_llm_cost_usd_total", "Estimated LLM spend in US dollars, priced with LLM_PRICING.", ["model", "view"])
+CACHE_REQUESTS = Counter("chatbot_cache_requests_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"])
+
+REGISTRY = [REQUESTS, REQUEST_DURATION, REQUEST_PHASE_DURATION, REQUEST_QUERIES,
+            LLM_REQUESTS, LLM_DURATION, LLM_TOKENS, LLM_COST, CACHE_REQUESTS]
+PHASES = ("llm", "db", "serialization")
+
+
+class RequestMetrics:
+    """
+    Time and query totals for one HTTP request. It is shared through a context variable, which asgiref copies
+    into the threads that run sync code for async views, so LLM, database and serialization hooks add to the
+    request that caused them.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    @property
+    def view(self):
+        match = getattr(self.request, "resolver_match", None)
+        return (match.url_name or match.view_name) if match else "unmatched"   # Never the raw path, which would be unbounded
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def current_view():
+    state = current_request.get()
+    return state.view if state else "none"
+
+
+def add_phase(phase, seconds):
+    """
+    Adds time to a phase of the current request, if any.
+
+    :param phase: One of PHASES
+    :param seconds: The time spent
+    """
+    state = current_request.get()
+    if state is not None:
+        with state.lock:
+            state.phases[phase] += seconds
+
+
+@contextmanager
+def timed(phase):
+    """
+    Context manager adding the time spent in its block to a phase of the current request.
+
+    :param phase: One of PHASES
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(phase, time.perf_counter() - start)
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query's time and count to the current request.
+    Installed on every connection by ChatbotConfig.ready().
+    """
+    state = current_request.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        with state.lock:
+            state.phases["db"] += time.perf_counter() - start
+            state.queries += 1
+
+
+def install_query_hook(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def start_request(request):
+    state = RequestMetrics(request)
+    current_request.set(state)
+    return state
+
+
+def finish_request(state, status):
+    """
+    Records the totals of a finished request.
+
+    :param state: The request's RequestMetrics
+    :param status: The response status code
+    """
+    view, method = state.view, state.request.method
+    REQUESTS.inc(view=view, method=method, status=status)
+    REQUEST_DURATION.observe(time.perf_counter() - state.start, view=view, method=method)
+    REQUEST_QUERIES.observe(state.queries, view=view)
+    for phase, seconds in state.phases.items():
+        REQUEST_PHASE_DURATION.observe(seconds, view=view, phase=phase)
+
+
+def llm_cost(model, prompt_tokens, completion_tokens):
+    """
+    Estimates the price of an LLM call from LLM_PRICING.
+
+    :return: The cost in US dollars, 0 for models without a configured price
+    """
+    prompt_price, completion_price = settings.LLM_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def record_llm_call(model, seconds, outcome, usage=None):
+    """
+    Records one LLM call against the current request's view and LLM phase.
+
+    :param model: The requested model
+    :param seconds: The duration of the call
+    :param outcome: 'ok', 'rate_limited' or 'error'
+    :param usage: The completion's usage, an object with prompt_tokens and completion_tokens, if any
+    """
+    view = current_view()
+    add_phase("llm", seconds)
+    LLM_DURATION.observe(seconds, model=model)
+    LLM_REQUESTS.inc(model=model, view=view, outcome=outcome)
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        LLM_TOKENS.inc(prompt_tokens, model=model, view=view, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=model, view=view, kind="completion")
+        LLM_COST.inc(llm_cost(model, prompt_tokens, completion_tokens), model=model, view=view)
+
+
+def record_cache_lookup(cache, hits, misses=0):
+    """
+    Counts cache hits and misses.
+
+    :param cache: The cache name, e.g. 'response' or 'classification'
+    :param hits: The number of hits
+    :param misses: The number of misses
+    """
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+def render():
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    :return: The exposition text
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
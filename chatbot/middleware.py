@@ -0,0 +1,64 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the wall time, status and database queries of every request, and the time it spent in LLM calls,
+    database queries and serialization, for the /metrics endpoint. Streamed responses are measured until their
+    last chunk has been sent. Works in both sync (WSGI) and async (ASGI) middleware chains.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = metrics.start_request(request)
+        return self.finish(state, self.get_response(request))
+
+    async def __acall__(self, request):
+        state = metrics.start_request(request)
+        return self.finish(state, await self.get_response(request))
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; the render is timed as serialization
+        start = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: metrics.add_phase("serialization", time.perf_counter() - start))
+        return response
+
+    def finish(self, state, response):
+        """
+        Records the request now, or once its streamed content is exhausted.
+
+        :param state: The request's RequestMetrics
+        :param response: The response returned by the view
+        :return: The response, with streamed content wrapped
+        """
+        if not response.streaming:
+            metrics.finish_request(state, response.status_code)
+            return response
+        content = response.streaming_content
+        if response.is_async:
+            async def observed():
+                try:
+                    async for chunk in content:
+                        yield chunk
+                finally:
+                    metrics.finish_request(state, response.status_code)
+        else:
+            def observed():
+                try:
+                    yield from content
+                finally:
+                    metrics.finish_request(state, response.status_code)
+        response.streaming_content = observed()
+        return response
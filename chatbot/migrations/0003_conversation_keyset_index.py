@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_classification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['created_at', 'id'], name='conversation_keyset_idx'),
+        ),
+    ]
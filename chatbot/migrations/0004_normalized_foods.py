@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def normalize_food_name(name):
+    return " ".join(str(name).lower().split())
+
+
+def copy_foods_from_json(apps, schema_editor):
+    """
+    Moves the JSON food lists in Conversation.favorite_foods into Food and ConversationFood rows.
+    """
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    Food = apps.get_model('chatbot', 'Food')
+    ConversationFood = apps.get_model('chatbot', 'ConversationFood')
+    food_ids = {}
+    links = []
+    for conversation_id, favorite_foods in Conversation.objects.values_list('id', 'favorite_foods').iterator(chunk_size=1000):
+        try:
+            foods = json.loads(favorite_foods) if favorite_foods else []
+        except ValueError:
+            foods = []  # Rows created without a valid food list have no foods to link
+        for position, name in enumerate(foods if isinstance(foods, list) else []):
+            name = normalize_food_name(name)
+            if not name:
+                continue
+            if name not in food_ids:
+                food_ids[name] = Food.objects.get_or_create(name=name)[0].id
+            links.append(ConversationFood(conversation_id=conversation_id, food_id=food_ids[name], position=position))
+        if len(links) >= 1000:
+            ConversationFood.objects.bulk_create(links)
+            links = []
+    ConversationFood.objects.bulk_create(links)
+
+
+def copy_foods_to_json(apps, schema_editor):
+    """
+    Rebuilds Conversation.favorite_foods from the linked foods when the migration is reversed.
+    """
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    ConversationFood = apps.get_model('chatbot', 'ConversationFood')
+    foods = {}
+    for conversation_id, name in ConversationFood.objects.order_by('conversation_id', 'position').values_list('conversation_id', 'food__name'):
+        foods.setdefault(conversation_id, []).append(name)
+    for conversation_id, names in foods.items():
+        Conversation.objects.filter(id=conversation_id).update(favorite_foods=json.dumps(names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_conversation_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Food',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='conversation',
+            name='is_vegetarian',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.CreateModel(
+            name='ConversationFood',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='food_links', to='chatbot.conversation')),
+                ('food', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_links', to='chatbot.food')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='foods',
+            field=models.ManyToManyField(related_name='conversations', through='chatbot.ConversationFood', to='chatbot.food'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationfood',
+            constraint=models.UniqueConstraint(fields=('conversation', 'position'), name='unique_food_position_per_conversation'),
+        ),
+        migrations.RunPython(copy_foods_from_json, copy_foods_to_json),
+        migrations.AlterField(
+            model_name='conversation',
+            name='favorite_foods',
+            field=models.TextField(default='[]'),  # Lets a reverse migration re-add the column to existing rows
+        ),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='favorite_foods',
+        ),
+    ]
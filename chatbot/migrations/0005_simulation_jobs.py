@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_normalized_foods'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='queued', max_length=16)),
+                ('total', models.PositiveIntegerField()),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimulationResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iteration', models.PositiveIntegerField()),
+                ('question', models.TextField()),
+                ('answer', models.TextField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='chatbot.simulationjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'iteration'), name='unique_iteration_per_job')],
+            },
+        ),
+    ]
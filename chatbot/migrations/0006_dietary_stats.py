@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:53
+
+import re
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+# A frozen copy of the dietary vocabulary of chatbot.dietary when this migration was written, so the migration
+# classifies the same way however that module changes later
+MEAT_TERMS = [
+    "chicken", "beef", "pork", "fish", "shrimp", "prawn", "lamb", "mutton", "turkey", "duck", "goose", "venison",
+    "goat", "rabbit", "veal", "bacon", "sausage", "ham", "hamburger", "cheeseburger", "pepperoni", "salami",
+    "prosciutto", "chorizo", "steak", "crab", "lobster", "squid", "calamari", "octopus", "clam", "mussel", "oyster",
+    "scallop", "anchovy", "sardine", "salmon", "tuna", "cod", "trout", "gelatin", "broth", "stock", "lard", "suet",
+    "tallow", "meat", "meatball", "seafood", "poultry", "game", "jerky",
+]
+# Animal products that keep a list vegetarian but not vegan
+ANIMAL_PRODUCT_TERMS = [
+    "egg", "dairy", "cheese", "milk", "butter", "honey", "cream", "ice cream", "yogurt", "yoghurt", "ghee", "whey",
+    "mayonnaise", "gelato", "paneer", "feta", "mozzarella", "parmesan", "parm", "parmigiana", "cheddar", "ricotta", "custard", "omelette",
+    "omelet", "pizza",
+]
+# Plant foods, including plant-based variants of the terms above, which win because longer matches are preferred
+PLANT_TERMS = [
+    "tofu", "tempeh", "seitan", "salad", "lentil", "bean", "chickpea", "hummus", "falafel", "edamame", "pasta",
+    "rice", "quinoa", "oats", "oatmeal", "bulgur", "barley", "millet", "couscous", "buckwheat", "bread", "noodle",
+    "tortilla", "pita", "potato", "sweet potato", "vegetable", "broccoli", "carrot", "spinach", "kale", "avocado",
+    "mushroom", "cucumber", "tomato", "onion", "garlic", "pepper", "corn", "pea", "cabbage", "eggplant", "zucchini",
+    "cauliflower", "brussels sprouts", "asparagus", "fruit", "apple", "banana", "orange", "berry", "blueberry",
+    "strawberry", "cranberry", "grape", "melon", "cherry", "mango", "papaya", "pineapple", "kiwi", "coconut", "fig",
+    "raisin", "almond", "cashew", "walnut", "peanut", "nut", "seed", "chia", "flax", "peanut butter",
+    "almond butter", "soy milk", "almond milk", "oat milk", "coconut milk", "vegetable broth", "vegetable stock",
+]
+
+
+def _forms(term):
+    forms = {term, term + "s", term + "es"}
+    if term.endswith("y") and term[-2:-1] not in "aeiou":
+        forms.add(term[:-1] + "ies")
+    return forms
+
+
+CATEGORIES = {form: category for category, terms in (('vegan', PLANT_TERMS), ('vegetarian', ANIMAL_PRODUCT_TERMS),
+                                                      ('neither', MEAT_TERMS)) for term in terms for form in _forms(term)}
+# Longest spellings first, so 'peanut butter' wins over 'peanut' like the trie matcher of chatbot.dietary
+FOOD_PATTERN = re.compile(r"\b(?:%s)\b" % "|".join(
+    re.escape(form).replace(r"\ ", r"\s+") for form in sorted(CATEGORIES, key=len, reverse=True)
+))
+
+
+def diet_of(text):
+    # Mirrors chatbot.stats.diet_of: meat wins over animal products, which win over plant foods
+    categories = {CATEGORIES[" ".join(match.group(0).split())] for match in FOOD_PATTERN.finditer(text.lower())}
+    for diet in ('neither', 'vegetarian', 'vegan'):
+        if diet in categories:
+            return diet
+    return 'unknown'
+
+
+def build_counters(apps, schema_editor):
+    # Counts the existing conversations, as chatbot.stats.rebuild does
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    ConversationFood = apps.get_model('chatbot', 'ConversationFood')
+    StatCounter = apps.get_model('chatbot', 'StatCounter')
+    counts = Counter()
+    for conversation in Conversation.objects.only('bot_response', 'created_at').iterator(chunk_size=2000):
+        diet = diet_of(conversation.bot_response)
+        day = timezone.localdate(conversation.created_at).isoformat()
+        counts.update([('total', ''), ('diet', diet), ('day', day), ('day_diet', f"{day}:{diet}")])
+    for name, count in ConversationFood.objects.values_list('food__name').annotate(count=Count('id')):
+        counts['food', name] = count
+    StatCounter.objects.bulk_create(
+        [StatCounter(dimension=dimension, key=key, count=count) for (dimension, key), count in counts.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_simulation_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', '-count'], name='stat_top_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='unique_stat_key')],
+            },
+        ),
+        migrations.RunPython(build_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_dietary_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
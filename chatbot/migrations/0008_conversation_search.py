@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+from django.db import migrations
+
+# SQLite: an external-content FTS5 table indexing the conversation text, kept in sync by triggers, so inserts
+# made with bulk_create, queryset updates and deletes are indexed too. Only the index is stored, not the text.
+# Django does not know about these triggers, and a later migration that makes SQLite rebuild chatbot_conversation
+# (altering or removing a field) drops them, leaving the index stale. chatbot.search recreates them after every
+# migrate, the chatbot.W001 system check reports them missing and 'manage.py rebuild_search_index' repairs them.
+SQLITE_FORWARDS = [
+    """CREATE VIRTUAL TABLE chatbot_conversation_fts USING fts5(
+        user_input, bot_response, content='chatbot_conversation', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER chatbot_conversation_fts_insert AFTER INSERT ON chatbot_conversation BEGIN
+        INSERT INTO chatbot_conversation_fts(rowid, user_input, bot_response) VALUES (new.id, new.user_input, new.bot_response);
+    END""",
+    """CREATE TRIGGER chatbot_conversation_fts_delete AFTER DELETE ON chatbot_conversation BEGIN
+        INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts, rowid, user_input, bot_response)
+        VALUES ('delete', old.id, old.user_input, old.bot_response);
+    END""",
+    """CREATE TRIGGER chatbot_conversation_fts_update AFTER UPDATE OF user_input, bot_response ON chatbot_conversation BEGIN
+        INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts, rowid, user_input, bot_response)
+        VALUES ('delete', old.id, old.user_input, old.bot_response);
+        INSERT INTO chatbot_conversation_fts(rowid, user_input, bot_response) VALUES (new.id, new.user_input, new.bot_response);
+    END""",
+    "INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts) VALUES ('rebuild')",   # Indexes the existing conversations
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS chatbot_conversation_fts_insert",
+    "DROP TRIGGER IF EXISTS chatbot_conversation_fts_delete",
+    "DROP TRIGGER IF EXISTS chatbot_conversation_fts_update",
+    "DROP TABLE IF EXISTS chatbot_conversation_fts",
+]
+# PostgreSQL: a generated tsvector column, weighting the user's words above the bot's, with a GIN index.
+# The database recomputes it on every insert and update.
+POSTGRES_FORWARDS = [
+    """ALTER TABLE chatbot_conversation ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(user_input, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(bot_response, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX chatbot_conversation_search_idx ON chatbot_conversation USING GIN (search_vector)",
+]
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS chatbot_conversation_search_idx",
+    "ALTER TABLE chatbot_conversation DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_conversation_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRES_FORWARDS}),
+            run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRES_BACKWARDS}),
+        ),
+    ]
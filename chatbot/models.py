@@ -1,18 +1,272 @@
-from django.db import models
-import json
+from django.db import models, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .vocabulary import canonical_food
 
 # Create your models here.
+
+
+def normalize_food_name(name):
+    """
+    Normalizes a food name for storage and lookup to its canonical vocabulary name, correcting case, plurals,
+    typos and trailing descriptions; names outside the vocabulary are lower-cased with whitespace collapsed.
+
+    :param name: The food name as entered or extracted
+    :return: The normalized name
+    """
+    return canonical_food(name)
+
+
+class FoodQuerySet(models.QuerySet):
+    def popular(self):
+        """
+        Orders foods by the number of conversations that list them, most popular first.
+        The count is aggregated by the database over the indexed ConversationFood table.
+
+        :return: A queryset of Food objects annotated with conversation_count
+        """
+        return self.annotate(conversation_count=Count('conversation_links')).order_by('-conversation_count', 'name')
+
+
+class Food(models.Model):
+    """
+    A distinct food that users have named as one of their favorites, shared by every conversation that lists it.
+    """
+    name = models.CharField(max_length=200, unique=True)    # Canonical food name; the unique index serves per-food lookups
+
+    objects = FoodQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+
+class ConversationQuerySet(models.QuerySet):
+    def with_food(self, name):
+        """
+        Filters conversations listing a food, answered by the database through the food name and link indexes.
+
+        :param name: The food name; it is normalized before the lookup
+        :return: A queryset of the matching conversations
+        """
+        return self.filter(food_links__food__name=normalize_food_name(name))
+
+    def vegetarian(self, is_vegetarian=True):
+        """
+        Filters conversations by their indexed is_vegetarian flag.
+
+        :param is_vegetarian: True for vegetarian users, False for the others
+        :return: A queryset of the matching conversations
+        """
+        return self.filter(is_vegetarian=is_vegetarian)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Creates conversations like QuerySet.bulk_create, which sends no post_save signals, and adds them to
+        the aggregate statistics in the same transaction.
+        """
+        from .stats import record_conversations
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            record_conversations(created, 1)
+        return created
+
+    def delete(self):
+        """
+        Deletes conversations like QuerySet.delete and removes them and their food links from the aggregate
+        statistics with one batch of counter updates, instead of one per deleted row.
+        """
+        from .stats import batched
+        with transaction.atomic(), batched():
+            return super().delete()
+
+    def create_with_foods(self, foods, **fields):
+        """
+        Creates a conversation and links its favorite foods in one transaction.
+
+        :param foods: A list of food names in the order the user gave them
+        :param fields: The Conversation field values
+        :return: The created Conversation
+        """
+        with transaction.atomic():
+            conversation = self.create(**fields)
+            conversation.set_foods(foods)
+        return conversation
+
+    def bulk_create_with_foods(self, entries):
+        """
+        Creates many conversations and links their favorite foods in one transaction, with a fixed number of
+        queries however many conversations there are.
+
+        :param entries: A list of (foods, fields) tuples, as taken by create_with_foods
+        :return: The created Conversations
+        """
+        names = [[normalize_food_name(food) for food in foods] for foods, _ in entries]
+        with transaction.atomic():
+            conversations = self.bulk_create([self.model(**fields) for _, fields in entries])
+            unique_names = {name for foods in names for name in foods}
+            Food.objects.bulk_create([Food(name=name) for name in unique_names], ignore_conflicts=True)
+            food_ids = dict(Food.objects.filter(name__in=unique_names).values_list('name', 'id'))
+            ConversationFood.objects.bulk_create([
+                ConversationFood(conversation=conversation, food_id=food_ids[name], position=position)
+                for conversation, foods in zip(conversations, names) for position, name in enumerate(foods)
+            ])
+        return conversations
+
+
 class Conversation(models.Model):
     user_input = models.TextField() # Stores the user's input text for the conversation
     bot_response = models.TextField()   # Stores the bot's response text to the user's input
-    favorite_foods = models.TextField() # JSON string of food list representing the user's favorite foods
-    is_vegetarian = models.BooleanField(default=False)  # Boolean flag indicating if the user is vegetarian, defaults to False
-    created_at = models.DateTimeField(auto_now_add=True)    # Automatically sets the date and time when the conversation record is created
+    foods = models.ManyToManyField(Food, through='ConversationFood', related_name='conversations')  # The user's favorite foods, linked in the order they were given
+    is_vegetarian = models.BooleanField(default=False, db_index=True)  # Boolean flag indicating if the user is vegetarian, defaults to False
+    created_at = models.DateTimeField(default=timezone.now)    # Set to the date and time the conversation record is created, unless given, e.g. by an import
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='conversation_keyset_idx'),  # Serves keyset pagination ordered by (created_at, id) and created_at lookups
+        ]
+
+    def delete(self, *args, **kwargs):
+        from .stats import batched
+        with transaction.atomic(), batched():     # Batches the counter updates of the conversation and its food links
+            return super().delete(*args, **kwargs)
 
     def get_food(self):
         """
-        Retrieves the favorite foods stored as a JSON string and converts it into a Python data structure.
+        Retrieves the user's favorite foods in the order they were given.
+
+        :return: A list of normalized food names
+        """
+        return [link.food.name for link in self.food_links.select_related('food').order_by('position')]
 
-        :return: A Python list or dictionary representing the user's favorite foods, parsed from the JSON string in favorite_foods.
+    def set_foods(self, foods):
+        """
+        Replaces the favorite foods of a saved conversation, creating Food rows for names not seen before.
+
+        :param foods: A list of food names in the order the user gave them
+        """
+        names = [normalize_food_name(food) for food in foods]
+        Food.objects.bulk_create([Food(name=name) for name in set(names)], ignore_conflicts=True)
+        food_ids = dict(Food.objects.filter(name__in=names).values_list('name', 'id'))
+        self.food_links.all().delete()
+        ConversationFood.objects.bulk_create([
+            ConversationFood(conversation=self, food_id=food_ids[name], position=position)
+            for position, name in enumerate(names)
+        ])
+
+
+class ConversationFoodQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Creates food links like QuerySet.bulk_create and adds them to the per-food statistics.
+        """
+        from .stats import record_food_links
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            record_food_links(created, 1)
+        return created
+
+    def delete(self):
+        """
+        Deletes food links like QuerySet.delete, updating the per-food statistics with one batch of updates.
         """
-        return json.loads(self.favorite_foods) # Parses and returns the JSON string of favorite_foods as a Python list or dictionary
\ No newline at end of file
+        from .stats import batched
+        with transaction.atomic(), batched():
+            return super().delete()
+
+
+class ConversationFood(models.Model):
+    """
+    Links a conversation to one of its favorite foods, keeping the position the user gave it.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='food_links')
+    food = models.ForeignKey(Food, on_delete=models.CASCADE, related_name='conversation_links')   # Indexed, so per-food lookups avoid a table scan
+    position = models.PositiveSmallIntegerField()   # Zero-based position of the food in the user's list
+
+    objects = ConversationFoodQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'position'], name='unique_food_position_per_conversation'),
+        ]
+
+
+class Classification(models.Model):
+    """
+    Stores the dietary classification of a bot response, keyed by a content hash of the response text
+    and the classifier version (model and prompt) that produced it, so each distinct response is only
+    classified once per version.
+    """
+    content_hash = models.CharField(max_length=64)  # SHA-256 hex digest of the classified bot_response text
+    version = models.CharField(max_length=100)  # Classifier version (model and prompt version) that produced the label
+    classification = models.CharField(max_length=16)    # One of 'vegetarian', 'vegan' or 'neither'
+    created_at = models.DateTimeField(auto_now_add=True)    # Automatically sets the date and time when the classification was stored
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'version'], name='unique_classification_per_version'),
+        ]
+
+
+class SimulationJob(models.Model):
+    """
+    A batch of simulated conversations requested through /simulate/ and run by a background worker
+    (manage.py run_simulation_jobs), so the web request returns immediately.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (COMPLETED, 'Completed'), (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)  # Indexed so workers find queued jobs quickly
+    total = models.PositiveIntegerField()   # Number of conversations to simulate
+    completed = models.PositiveIntegerField(default=0)  # Number of results stored so far
+    error = models.TextField(blank=True)    # The error that made the job fail, if any
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True) # Heartbeat refreshed as results are stored; stale running jobs are requeued
+
+
+class SimulationResult(models.Model):
+    """
+    One simulated conversation produced by a SimulationJob, stored as soon as it is available so
+    progress can be polled while the job runs.
+    """
+    job = models.ForeignKey(SimulationJob, on_delete=models.CASCADE, related_name='results')
+    iteration = models.PositiveIntegerField()   # One-based position of the result within its job
+    question = models.TextField()
+    answer = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'iteration'], name='unique_iteration_per_job'),
+        ]
+
+
+class StatCounter(models.Model):
+    """
+    A materialized count of conversations, kept up to date as conversations and their food links are created
+    and deleted (see chatbot.stats), so dashboard statistics are read without scanning conversations.
+    QuerySet.update() bypasses the bookkeeping; run manage.py rebuild_stats after bulk edits.
+    """
+    TOTAL = 'total'     # key '': every conversation
+    DIET = 'diet'       # key: vegan, vegetarian, neither or unknown
+    FOOD = 'food'       # key: normalized food name
+    DAY = 'day'         # key: ISO date the conversation was created
+    DAY_DIET = 'day_diet'   # key: '<ISO date>:<diet>'
+
+    dimension = models.CharField(max_length=16)
+    key = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='unique_stat_key'),
+        ]
+        indexes = [
+            models.Index(fields=['dimension', '-count'], name='stat_top_count_idx'),   # Serves the most popular foods
+        ]
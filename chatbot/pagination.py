@@ -0,0 +1,87 @@
+import base64
+import math
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a pagination cursor supplied by a client cannot be decoded.
+    """
+
+
+def encode_cursor(conversation):
+    """
+    Encodes the keyset position just after a conversation as an opaque, URL-safe cursor.
+
+    :param conversation: The last Conversation of a page
+    :return: A base64 string encoding its created_at timestamp and id
+    """
+    position = f"{conversation.created_at.isoformat()}|{conversation.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_cursor().
+
+    :param cursor: The opaque cursor string
+    :return: A (created_at, id) tuple
+    :raises InvalidCursor: If the cursor is malformed
+    """
+    try:
+        created_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(conversation_id)
+    except (ValueError, UnicodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from error
+
+
+def encode_score_cursor(conversation):
+    """
+    Encodes the position just after a ranked search result as an opaque, URL-safe cursor.
+
+    :param conversation: The last Conversation of a page of search results, with its 'score' attribute
+    :return: A base64 string encoding its score and id
+    """
+    position = f"{conversation.score!r}|{conversation.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_score_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_score_cursor().
+
+    :param cursor: The opaque cursor string
+    :return: A (score, id) tuple
+    :raises InvalidCursor: If the cursor is malformed
+    """
+    try:
+        score, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        score = float(score)
+        if not math.isfinite(score):
+            raise ValueError(score)
+        return score, int(conversation_id)
+    except (ValueError, UnicodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from error
+
+
+def keyset_page(queryset, cursor, page_size):
+    """
+    Fetches one page of a queryset ordered by (created_at, id), starting after the cursor position.
+    Each page is a fresh indexed range query, so its cost does not depend on how deep the page is.
+
+    :param queryset: The Conversation queryset to paginate
+    :param cursor: The cursor returned with the previous page, or None for the first page
+    :param page_size: The maximum number of rows per page
+    :return: A (rows, next_cursor) tuple; next_cursor is None on the last page
+    :raises InvalidCursor: If the cursor is malformed
+    """
+    queryset = queryset.order_by('created_at', 'id')
+    if cursor:
+        created_at, conversation_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=conversation_id))
+    rows = list(queryset[:page_size + 1])   # Fetches one extra row to learn whether another page follows
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
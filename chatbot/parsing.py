@@ -0,0 +1,86 @@
+import re
+
+from .dietary import classify_foods
+from .vocabulary import clean_food_name, food_index
+
+# Numbering such as '1.', '2)' or '3:' at the start of the text or after whitespace
+NUMBERING_PATTERN = re.compile(r"(?:^|(?<=\s)|(?<=,))\d+\s*[.):]\s*")
+BULLET_PATTERN = re.compile(r"^\s*[-*•]+\s*")
+AND_PATTERN = re.compile(r"\s*\band\b\s*", re.IGNORECASE)
+# Lead-ins users commonly type before their list, e.g. 'My top 3 favorite foods are:' or 'I love'
+LEAD_IN_PATTERN = re.compile(
+    r"^\s*(?:my\s+(?:top\s+(?:3|three)\s+)?(?:favou?rite\s+)?foods?\s+(?:are|is)|i\s+(?:really\s+)?(?:like|love|enjoy))\s*:?\s*",
+    re.IGNORECASE
+)
+# A food name: letters, spaces and a few joining characters, at most MAX_FOOD_WORDS words
+FOOD_PATTERN = re.compile(r"^[^\W\d_]+(?:[\s'&-]+[^\W\d_]+)*$")
+MAX_FOOD_WORDS = 5
+
+
+def split_foods(text):
+    """
+    Splits a food list into its items. Numbered lists split on their numbering, bulleted or multi-line lists on
+    line breaks, comma lists on commas (with 'x and y' in the last item split too), and anything else on 'and'.
+    Each item has its whitespace collapsed and trailing punctuation removed.
+
+    :param text: The text to split
+    :return: A list of non-empty items, in order
+    """
+    text = LEAD_IN_PATTERN.sub("", text.strip())
+    if NUMBERING_PATTERN.search(text):
+        parts = NUMBERING_PATTERN.split(text)
+    elif "\n" in text:
+        parts = text.splitlines()
+    elif "," in text or ";" in text:
+        parts = re.split(r"[,;]", text)
+        if len(parts) == 2:
+            parts = parts[:1] + AND_PATTERN.split(parts[1])    # 'pizza, pasta and salad'
+    else:
+        parts = AND_PATTERN.split(text)
+    items = []
+    for part in parts:
+        part = " ".join(BULLET_PATTERN.sub("", part).split()).strip(" .,;:!")
+        part = re.sub(r"^and\s+", "", part, flags=re.IGNORECASE)   # 'pizza, pasta, and salad'
+        if part:
+            items.append(part)
+    return items
+
+
+def is_known_food(item):
+    """
+    :param item: One item of a food list
+    :return: Whether the item names a food of the dietary vocabulary or the canonical food list
+    """
+    return classify_foods(item).verdict is not None or food_index().lookup(clean_food_name(item)) is not None
+
+
+def parse_foods(user_input):
+    """
+    Deterministically extracts exactly three favorite foods from well-formed user input, such as
+    '1. pizza 2. pasta 3. salad', 'pizza, pasta and salad', a bulleted list or 'pizza and pasta and salad'.
+    Every item must be a known food, so small talk such as 'yes, sure, ok' and foods outside the vocabulary
+    are left to the LLM.
+
+    :param user_input: The raw user input
+    :return: A list of three food names, or None if the input is malformed, conversational or has unknown items
+    """
+    if "?" in user_input:
+        return None # Questions are conversational and are left to the LLM
+    foods = split_foods(user_input)
+    if len(foods) != 3:
+        return None
+    for food in foods:
+        if not FOOD_PATTERN.match(food) or len(food.split()) > MAX_FOOD_WORDS or not is_known_food(food):
+            return None
+    return foods
+
+
+def confirmation_message(foods):
+    """
+    Builds the chatbot's confirmation for a parsed food list, in the format the LLM prompt asks for.
+
+    :param foods: The three parsed food names
+    :return: The confirmation text
+    """
+    listed = ", ".join(f"{position}. {food}" for position, food in enumerate(foods, start=1))
+    return f"Thank you for sharing! Your top 3 favorite foods are: {listed}."
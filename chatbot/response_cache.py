@@ -0,0 +1,80 @@
+import hashlib
+
+from django.core.cache import caches
+
+from . import metrics
+from .parsing import split_foods
+
+CACHE_ALIAS = 'responses'   # The CACHES entry holding chatbot responses, see settings.CACHES
+KEY_PREFIX = 'chatbot:response:'
+HITS_KEY = 'chatbot:response-cache:hits'
+MISSES_KEY = 'chatbot:response-cache:misses'
+
+
+def normalize_foods(user_input):
+    """
+    Normalizes a user's food list so equivalent inputs share a cache entry: the text is case-folded,
+    whitespace is collapsed, list numbering, bullets and separators are dropped and the foods are sorted.
+
+    :param user_input: The raw user input
+    :return: A sorted list of normalized food strings
+    """
+    return sorted(food.casefold() for food in split_foods(user_input))
+
+
+def cache_key(user_input, model):
+    """
+    Builds the cache key for a user input, ignoring case, whitespace, numbering and food order.
+
+    :param user_input: The raw user input
+    :param model: The model that produces the response, so a model change never serves stale replies
+    :return: A fixed-length cache key
+    """
+    normalized = "\n".join(normalize_foods(user_input))
+    return KEY_PREFIX + hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+async def _count(key):
+    cache = caches[CACHE_ALIAS]
+    await cache.aadd(key, 0, timeout=None)  # Creates the counter if needed; counters never expire
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        pass    # The counter was evicted between add and incr; the next call recreates it
+
+
+async def aget_response(user_input, model):
+    """
+    Looks up a cached chatbot response and counts the hit or miss.
+
+    :param user_input: The raw user input
+    :param model: The model that produces the response
+    :return: The cached response text, or None on a miss
+    """
+    response = await caches[CACHE_ALIAS].aget(cache_key(user_input, model))
+    await _count(MISSES_KEY if response is None else HITS_KEY)
+    metrics.record_cache_lookup('response', hits=int(response is not None), misses=int(response is None))
+    return response
+
+
+async def aset_response(user_input, model, response):
+    """
+    Stores a chatbot response; the cache's TIMEOUT and MAX_ENTRIES settings bound its lifetime and size.
+
+    :param user_input: The raw user input
+    :param model: The model that produced the response
+    :param response: The response text to cache
+    """
+    await caches[CACHE_ALIAS].aset(cache_key(user_input, model), response)
+
+
+def cache_stats():
+    """
+    Returns the response cache hit and miss counters. With a shared backend such as Redis the counters
+    cover every worker; with the default local-memory backend they cover the current process.
+
+    :return: A dictionary with 'hits', 'misses' and 'hit_rate'
+    """
+    counters = caches[CACHE_ALIAS].get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
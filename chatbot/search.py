@@ -0,0 +1,165 @@
+import logging
+import re
+
+from django.db import connection, connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Prefetch
+
+from .models import Conversation, ConversationFood
+from .pagination import decode_score_cursor, encode_score_cursor
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MIGRATION = ('chatbot', '0008_conversation_search')
+
+COLUMNS = "c.id, c.user_input, c.bot_response, c.is_vegetarian, c.created_at"
+# bm25() is lower for better matches; the weights rank a match in the user's input above one in the bot's response
+SQLITE_MATCHES = f"""
+    SELECT {COLUMNS}, -bm25(chatbot_conversation_fts, 2.0, 1.0) AS score
+    FROM chatbot_conversation_fts JOIN chatbot_conversation c ON c.id = chatbot_conversation_fts.rowid
+    WHERE chatbot_conversation_fts MATCH %s
+"""
+POSTGRES_MATCHES = f"""
+    SELECT {COLUMNS}, ts_rank_cd(c.search_vector, query)::float8 AS score
+    FROM chatbot_conversation c, websearch_to_tsquery('english', %s) query
+    WHERE c.search_vector @@ query
+"""
+# Keyset pagination on (score, id): a page starts after the last result of the previous one instead of skipping rows
+SEARCH_PAGE = "SELECT * FROM ({matches}) matches {after} ORDER BY score DESC, id DESC LIMIT %s"
+AFTER_CURSOR = "WHERE score < %s OR (score = %s AND id < %s)"
+
+# The database objects of the search index created by migration 0008, as (name, statement creating it if missing).
+# Django does not know about them: a later migration that rebuilds the conversation table, as SQLite does to
+# alter or drop a column, silently drops the triggers, so they are checked and recreated after every migrate.
+SEARCH_OBJECTS = {
+    'sqlite': [
+        ("chatbot_conversation_fts", """CREATE VIRTUAL TABLE IF NOT EXISTS chatbot_conversation_fts USING fts5(
+            user_input, bot_response, content='chatbot_conversation', content_rowid='id', tokenize='porter unicode61'
+        )"""),
+        ("chatbot_conversation_fts_insert", """CREATE TRIGGER IF NOT EXISTS chatbot_conversation_fts_insert AFTER INSERT ON chatbot_conversation BEGIN
+            INSERT INTO chatbot_conversation_fts(rowid, user_input, bot_response) VALUES (new.id, new.user_input, new.bot_response);
+        END"""),
+        ("chatbot_conversation_fts_delete", """CREATE TRIGGER IF NOT EXISTS chatbot_conversation_fts_delete AFTER DELETE ON chatbot_conversation BEGIN
+            INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts, rowid, user_input, bot_response)
+            VALUES ('delete', old.id, old.user_input, old.bot_response);
+        END"""),
+        ("chatbot_conversation_fts_update", """CREATE TRIGGER IF NOT EXISTS chatbot_conversation_fts_update AFTER UPDATE OF user_input, bot_response ON chatbot_conversation BEGIN
+            INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts, rowid, user_input, bot_response)
+            VALUES ('delete', old.id, old.user_input, old.bot_response);
+            INSERT INTO chatbot_conversation_fts(rowid, user_input, bot_response) VALUES (new.id, new.user_input, new.bot_response);
+        END"""),
+    ],
+    'postgresql': [
+        ("search_vector", """ALTER TABLE chatbot_conversation ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(user_input, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(bot_response, '')), 'B')
+        ) STORED"""),
+        ("chatbot_conversation_search_idx", "CREATE INDEX IF NOT EXISTS chatbot_conversation_search_idx ON chatbot_conversation USING GIN (search_vector)"),
+    ],
+}
+EXISTING_OBJECTS = {
+    'sqlite': "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')",
+    'postgresql': """SELECT column_name FROM information_schema.columns
+                     WHERE table_schema = current_schema() AND table_name = 'chatbot_conversation'
+                     UNION SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()""",
+}
+SQLITE_REBUILD = "INSERT INTO chatbot_conversation_fts(chatbot_conversation_fts) VALUES ('rebuild')"
+
+
+class SearchUnavailable(Exception):
+    """
+    Raised when the database has no full-text search index for conversations.
+    """
+
+
+def match_expression(query):
+    """
+    Turns free text into an FTS5 query matching conversations that contain every word, each quoted so
+    characters that are FTS5 syntax, such as '-', '*' or ':', are searched for as text.
+
+    :param query: The search text as typed by the user
+    :return: The FTS5 MATCH expression, or an empty string if the text has no words
+    """
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query.lower()))
+
+
+def search_conversations(query, cursor=None, page_size=20):
+    """
+    Finds conversations whose user input or bot response contains every word of the query, best matches
+    first, through the full-text index created by migration 0008: FTS5 on SQLite, a tsvector column on
+    PostgreSQL. The index is maintained by the database, so searches never scan the conversation table.
+
+    :param query: The search text; words are stemmed, so 'sausage' also finds 'sausages'
+    :param cursor: The cursor returned with the previous page, or None for the first page
+    :param page_size: The maximum number of conversations per page
+    :return: A (conversations, next_cursor) tuple; each Conversation has a 'score' attribute and its food links
+             prefetched, and next_cursor is None on the last page
+    :raises InvalidCursor: If the cursor is malformed
+    :raises SearchUnavailable: If the database is neither SQLite nor PostgreSQL, which have no search index
+    """
+    if connection.vendor == 'postgresql':
+        matches, term = POSTGRES_MATCHES, query
+    elif connection.vendor == 'sqlite':
+        matches, term = SQLITE_MATCHES, match_expression(query)
+    else:
+        raise SearchUnavailable(f"Conversation search is not supported on {connection.vendor}")
+    params = [term]
+    if cursor:
+        score, conversation_id = decode_score_cursor(cursor)
+        params += [score, score, conversation_id]
+    if not term.strip():
+        return [], None
+    sql = SEARCH_PAGE.format(matches=matches, after=AFTER_CURSOR if cursor else "")
+    links = ConversationFood.objects.select_related('food').order_by('position')
+    # Fetches one extra row to learn whether another page follows
+    conversations = list(Conversation.objects.raw(sql, params + [page_size + 1])
+                         .prefetch_related(Prefetch('food_links', queryset=links)))
+    if len(conversations) > page_size:
+        return conversations[:page_size], encode_score_cursor(conversations[page_size - 1])
+    return conversations, None
+
+
+def missing_search_objects(using='default'):
+    """
+    Lists the objects of the search index that migration 0008 created but the database no longer has.
+
+    :param using: The database alias
+    :return: A list of object names; empty if nothing is missing, the migration is not applied or the
+             database has no search index
+    """
+    db = connections[using]
+    if db.vendor not in SEARCH_OBJECTS or SEARCH_MIGRATION not in MigrationRecorder(db).applied_migrations():
+        return []
+    with db.cursor() as cursor:
+        cursor.execute(EXISTING_OBJECTS[db.vendor])
+        existing = {name for name, in cursor.fetchall()}
+    return [name for name, _ in SEARCH_OBJECTS[db.vendor] if name not in existing]
+
+
+def repair_search_index(using='default', rebuild=False):
+    """
+    Recreates the missing objects of the search index. On SQLite the index missed every change made while a
+    trigger was gone, so it is then rebuilt from the conversations; PostgreSQL computes a re-added column itself.
+
+    :param using: The database alias
+    :param rebuild: Whether to rebuild the SQLite index even if nothing was missing
+    :return: The names of the recreated objects
+    """
+    db = connections[using]
+    missing = missing_search_objects(using)
+    with transaction.atomic(using=using), db.cursor() as cursor:
+        for name, statement in SEARCH_OBJECTS.get(db.vendor, []):
+            if name in missing:
+                cursor.execute(statement)
+        if db.vendor == 'sqlite' and (missing or rebuild) and SEARCH_MIGRATION in MigrationRecorder(db).applied_migrations():
+            cursor.execute(SQLITE_REBUILD)
+    return missing
+
+
+def restore_search_index(sender, using='default', **kwargs):
+    """
+    post_migrate receiver recreating search index objects that a migration dropped.
+    """
+    recreated = repair_search_index(using)
+    if recreated:
+        logger.warning(f"Recreated the conversation search index objects dropped by a migration: {', '.join(recreated)}")
@@ -0,0 +1,247 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .dietary import classify_foods
+from .models import Conversation, ConversationFood, Food, StatCounter
+
+DIETS = ('vegan', 'vegetarian', 'neither', 'unknown')
+UPDATE_CHUNK_SIZE = 400     # Counters per UPDATE, two parameters each, within the database's parameter limit
+
+_batch = ContextVar('stat_batch', default=None)    # (deltas, food id deltas) collected by batched()
+
+
+def diet_of(bot_response):
+    """
+    Classifies a conversation for the statistics with the local dietary vocabulary only, so keeping them
+    up to date never calls the LLM. Responses without known food terms are counted as 'unknown'.
+
+    :param bot_response: The bot's response text
+    :return: One of DIETS
+    """
+    return classify_foods(bot_response).verdict or 'unknown'
+
+
+def conversation_keys(conversation):
+    """
+    Lists the counters a conversation contributes to, apart from its foods.
+
+    :param conversation: A saved Conversation, or any object with bot_response and created_at
+    :return: A list of (dimension, key) tuples
+    """
+    diet = diet_of(conversation.bot_response)
+    day = timezone.localdate(conversation.created_at).isoformat()
+    return [
+        (StatCounter.TOTAL, ''),
+        (StatCounter.DIET, diet),
+        (StatCounter.DAY, day),
+        (StatCounter.DAY_DIET, f"{day}:{diet}"),
+    ]
+
+
+def apply(deltas):
+    """
+    Adds deltas to the counters, creating missing ones. Counters with the same delta are updated by one
+    UPDATE ... SET count = count + delta, so a batch usually costs two queries.
+
+    :param deltas: A mapping of (dimension, key) to the amount to add
+    """
+    deltas = {dimension_key: delta for dimension_key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    StatCounter.objects.bulk_create(
+        [StatCounter(dimension=dimension, key=key) for dimension, key in deltas], ignore_conflicts=True
+    )
+    grouped = defaultdict(list)
+    for dimension_key, delta in deltas.items():
+        grouped[delta].append(dimension_key)
+    for delta, dimension_keys in grouped.items():
+        for start in range(0, len(dimension_keys), UPDATE_CHUNK_SIZE):
+            condition = Q()
+            for dimension, key in dimension_keys[start:start + UPDATE_CHUNK_SIZE]:
+                condition |= Q(dimension=dimension, key=key)
+            StatCounter.objects.filter(condition).update(count=F('count') + delta)
+
+
+@contextmanager
+def batched():
+    """
+    Collects the counter changes recorded inside the block and applies them together when it exits, so
+    deleting many conversations, which sends one post_delete signal per row, costs a fixed number of queries.
+    Run it inside the transaction making the changes; nothing is applied if the block raises.
+    Nested blocks add to the outermost one.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+    deltas, food_deltas = Counter(), Counter()
+    token = _batch.set((deltas, food_deltas))
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    names = dict(Food.objects.filter(id__in=[food_id for food_id, delta in food_deltas.items() if delta]).values_list('id', 'name'))
+    for food_id, delta in food_deltas.items():
+        if delta:
+            deltas[StatCounter.FOOD, names[food_id]] += delta
+    apply(deltas)
+
+
+def record_conversations(conversations, sign):
+    """
+    Adds conversations to (sign=1) or removes them from (sign=-1) the statistics.
+    """
+    batch = _batch.get()
+    deltas = batch[0] if batch else Counter()
+    for conversation in conversations:
+        for dimension_key in conversation_keys(conversation):
+            deltas[dimension_key] += sign
+    if not batch:
+        apply(deltas)
+
+
+def record_food_links(links, sign):
+    """
+    Adds food links to (sign=1) or removes them from (sign=-1) the per-food statistics.
+    """
+    batch = _batch.get()
+    if batch:
+        for link in links:
+            batch[1][link.food_id] += sign
+        return
+    names = dict(Food.objects.filter(id__in={link.food_id for link in links}).values_list('id', 'name'))
+    deltas = Counter()
+    for link in links:
+        deltas[StatCounter.FOOD, names[link.food_id]] += sign
+    apply(deltas)
+
+
+@receiver(pre_save, sender=Conversation)
+def remember_conversation_keys(sender, instance, raw=False, **kwargs):
+    # Keeps the counters of the stored row, so an update can move the conversation between them
+    if not raw and not instance._state.adding and instance.pk:
+        previous = Conversation.objects.filter(pk=instance.pk).only('bot_response', 'created_at').first()
+        instance._previous_stat_keys = conversation_keys(previous) if previous else None
+
+
+@receiver(post_save, sender=Conversation)
+def count_saved_conversation(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = Counter(conversation_keys(instance))
+    if not created:
+        previous = getattr(instance, '_previous_stat_keys', None)
+        if previous is None:
+            return
+        deltas.subtract(previous)
+    apply(deltas)
+
+
+@receiver(post_delete, sender=Conversation)
+def count_deleted_conversation(sender, instance, **kwargs):
+    record_conversations([instance], -1)
+
+
+@receiver(pre_save, sender=ConversationFood)
+def remember_food_link(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding and instance.pk:
+        instance._previous_food_id = ConversationFood.objects.filter(pk=instance.pk).values_list('food_id', flat=True).first()
+
+
+@receiver(post_save, sender=ConversationFood)
+def count_saved_food_link(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_food_links([instance], 1)
+    else:
+        previous_food_id = getattr(instance, '_previous_food_id', None)
+        if previous_food_id is not None and previous_food_id != instance.food_id:
+            record_food_links([ConversationFood(food_id=previous_food_id)], -1)
+            record_food_links([instance], 1)
+
+
+@receiver(post_delete, sender=ConversationFood)
+def count_deleted_food_link(sender, instance, **kwargs):
+    record_food_links([instance], -1)
+
+
+def compute_counts():
+    """
+    Computes every counter from scratch by reading all conversations once.
+
+    :return: A Counter mapping (dimension, key) to its count
+    """
+    counts = Counter()
+    for conversation in Conversation.objects.only('bot_response', 'created_at').iterator(chunk_size=2000):
+        counts.update(conversation_keys(conversation))
+    for name, count in ConversationFood.objects.values_list('food__name').annotate(count=Count('id')):
+        counts[StatCounter.FOOD, name] = count
+    return counts
+
+
+def stored_counts():
+    """
+    :return: A Counter mapping (dimension, key) to its stored, non-zero count
+    """
+    return Counter({(dimension, key): count for dimension, key, count in
+                    StatCounter.objects.exclude(count=0).values_list('dimension', 'key', 'count')})
+
+
+def rebuild():
+    """
+    Replaces the stored counters with freshly computed ones.
+
+    :return: The number of counters stored
+    """
+    counts = compute_counts()
+    with transaction.atomic():
+        StatCounter.objects.all().delete()
+        StatCounter.objects.bulk_create(
+            [StatCounter(dimension=dimension, key=key, count=count) for (dimension, key), count in counts.items()],
+            batch_size=1000
+        )
+    return len(counts)
+
+
+def empty_day():
+    return {"total": 0, **dict.fromkeys(DIETS, 0)}
+
+
+def dietary_stats(top_foods=10, days=30):
+    """
+    Reads the dashboard statistics from the counters with two queries, whatever the number of conversations.
+
+    :param top_foods: How many of the most popular foods to return
+    :param days: How many daily buckets to return, ending today
+    :return: A dictionary with 'total', 'diets', 'top_foods' and 'daily'
+    """
+    first_day = (timezone.localdate() - timedelta(days=days - 1)).isoformat()
+    rows = StatCounter.objects.filter(dimension__in=[StatCounter.TOTAL, StatCounter.DIET, StatCounter.DAY, StatCounter.DAY_DIET]) \
+        .exclude(dimension__in=[StatCounter.DAY, StatCounter.DAY_DIET], key__lt=first_day) \
+        .values_list('dimension', 'key', 'count')
+    total, diets, daily = 0, dict.fromkeys(DIETS, 0), {}
+    for dimension, key, count in rows:
+        if dimension == StatCounter.TOTAL:
+            total = count
+        elif dimension == StatCounter.DIET:
+            diets[key] = count
+        elif dimension == StatCounter.DAY:
+            daily.setdefault(key, empty_day())['total'] = count
+        else:
+            day, diet = key.split(':')
+            daily.setdefault(day, empty_day())[diet] = count
+    foods = StatCounter.objects.filter(dimension=StatCounter.FOOD, count__gt=0).order_by('-count', 'key')[:top_foods]
+    return {
+        "total": total,
+        "diets": diets,
+        "top_foods": [{"name": food.key, "count": food.count} for food in foods],
+        "daily": [{"date": day, **daily[day]} for day in sorted(daily)],
+    }
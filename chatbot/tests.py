@@ -1,3 +1,523 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import json
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import classification, llm, metrics, response_cache, write_behind
+from .checks import check_search_index
+from .classification import aclassify_batch, normalize_label, parse_batch_response
+from .dietary import classify_foods
+from .jobs import claim_next_job, enqueue_simulation, requeue_stale_jobs, store_results
+from .memory import SESSION_KEY, ConversationMemory
+from .models import Conversation, ConversationFood, SimulationJob, StatCounter
+from .pagination import InvalidCursor, decode_cursor, decode_score_cursor, encode_cursor, keyset_page
+from .parsing import parse_foods
+from .search import SearchUnavailable, missing_search_objects, repair_search_index, search_conversations
+from .stats import batched, compute_counts, dietary_stats, stored_counts
+from .views import PROMPT_AGAIN_MESSAGE
+from .vocabulary import canonical_food
+
+
+class ClassifyFoodsTests(SimpleTestCase):
+    def test_meat_makes_a_list_neither(self):
+        self.assertEqual(classify_foods("1. tofu 2. rice 3. chicken").verdict, "neither")
+
+    def test_animal_products_make_a_list_vegetarian(self):
+        self.assertEqual(classify_foods("pizza, salad and cheese").verdict, "vegetarian")
+
+    def test_plant_foods_make_a_list_vegan(self):
+        self.assertEqual(classify_foods("Tofu, Lentils and Broccoli").verdict, "vegan")
+
+    def test_longer_plant_term_wins_over_its_animal_prefix(self):
+        verdict = classify_foods("peanut butter, almond milk and rice")
+        self.assertEqual(verdict.verdict, "vegan")
+        self.assertEqual(verdict.terms, ("peanut butter", "almond milk", "rice"))
+
+    def test_plurals_and_whitespace_are_matched(self):
+        verdict = classify_foods("Berries,  sweet\npotatoes and anchovies")
+        self.assertEqual(verdict.verdict, "neither")
+        self.assertEqual(verdict.terms, ("berry", "sweet potato", "anchovy"))
+
+    def test_terms_only_match_whole_words(self):
+        self.assertIsNone(classify_foods("hamster, pearl and cornwall").verdict)
+
+    def test_text_without_food_terms_has_no_verdict(self):
+        self.assertEqual(classify_foods("I don't know, maybe later"), (None, ()))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Two conversations share a timestamp, so the cursor must break the tie on id
+        self.conversations = [
+            Conversation.objects.create(user_input=str(i), bot_response="", created_at=now + timedelta(seconds=i // 2))
+            for i in range(5)
+        ]
+
+    def test_cursor_round_trips(self):
+        conversation = self.conversations[1]
+        self.assertEqual(decode_cursor(encode_cursor(conversation)), (conversation.created_at, conversation.id))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ("not-base64!", "bm8tc2VwYXJhdG9y", encode_cursor(self.conversations[0])[:-4]):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_pages_cover_every_row_once_across_equal_timestamps(self):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(Conversation.objects.all(), cursor, 2)
+            seen.extend(rows)
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.conversations)
+
+    def test_last_full_page_has_no_next_cursor(self):
+        rows, cursor = keyset_page(Conversation.objects.all(), encode_cursor(self.conversations[2]), 2)
+        self.assertEqual(rows, self.conversations[3:])
+        self.assertIsNone(cursor)
+
+
+class ParseFoodsTests(SimpleTestCase):
+    def test_well_formed_lists_are_parsed(self):
+        for user_input in ("1. Pizza 2. pasta 3. salad", "pizza, pasta and salad", "- pizza\n- pasta\n- salad",
+                           "pizza and pasta and salad", "My favorite foods are: pizza, pasta, and salad"):
+            with self.subTest(user_input=user_input):
+                self.assertEqual([food.lower() for food in parse_foods(user_input)], ["pizza", "pasta", "salad"])
+
+    def test_small_talk_is_left_to_the_llm(self):
+        for user_input in ("no, not really, thanks", "I don't know, maybe, later", "yes, sure, ok",
+                           "hello there, how, are you"):
+            with self.subTest(user_input=user_input):
+                self.assertIsNone(parse_foods(user_input))
+
+    def test_malformed_lists_are_rejected(self):
+        for user_input in ("pizza, pasta", "pizza, pasta, salad, rice", "pizza, pasta or salad?", "1. pizza 2. 42 3. salad"):
+            with self.subTest(user_input=user_input):
+                self.assertIsNone(parse_foods(user_input))
+
+    def test_every_item_must_be_a_known_food(self):
+        self.assertIsNone(parse_foods("pizza, pasta, my grandmother"))
+        self.assertEqual(parse_foods("brocoli, tofu, grilled salmon"), ["brocoli", "tofu", "grilled salmon"])
+
+
+class ConversationMemoryTests(SimpleTestCase):
+    def remember(self, memory, *inputs):
+        for user_input in inputs:
+            async_to_sync(memory.aremember)(user_input, "Which other foods do you like?", completed=False)
+
+    def test_pieces_over_several_turns_make_a_list(self):
+        memory = ConversationMemory()
+        self.remember(memory, "pizza")
+        self.assertEqual(memory.parse_pieces("pasta and salad"), (["pizza", "pasta", "salad"], "pizza\npasta and salad"))
+
+    def test_small_talk_is_not_carried_over(self):
+        memory = ConversationMemory()
+        self.remember(memory, "hi", "I am fine", "pizza", "how are you?")
+        self.assertEqual(memory.pending, ["pizza"])
+        self.assertEqual(memory.parse_pieces("pasta and salad")[0], ["pizza", "pasta", "salad"])
+
+    def test_small_talk_pieces_are_not_saved_as_foods(self):
+        for pending, user_input in ((["hi", "I am fine"], "ok"), (["hello there"], "not sure, maybe later")):
+            with self.subTest(pending=pending):
+                memory = ConversationMemory(pending=pending)
+                self.assertEqual(memory.parse_pieces(user_input), (None, user_input))
+
+
+class CanonicalFoodTests(SimpleTestCase):
+    def test_variants_map_to_the_canonical_name(self):
+        for name in ("Sausages", "sausage", "sausges", "Sausages: smoky and spicy", "the sausages"):
+            with self.subTest(name=name):
+                self.assertEqual(canonical_food(name), "sausages")
+
+    def test_typos_only_match_real_spellings(self):
+        self.assertEqual(canonical_food("beets"), "beets")   # Not 'beef' through its generated plural 'beefs'
+        self.assertEqual(canonical_food("carot"), "carrots")
+        self.assertEqual(canonical_food("beefs"), "beef")
+
+    def test_typos_never_change_the_diet(self):
+        self.assertEqual(canonical_food("goats"), "goats")   # Not 'oats'
+        self.assertEqual(classify_foods(canonical_food("beets")).verdict, classify_foods("beets").verdict)
+
+    def test_leading_modifiers_without_food_are_dropped(self):
+        self.assertEqual(canonical_food("grilled Salmon"), "salmon")
+        self.assertEqual(canonical_food("fresh brocoli"), "broccoli")
+
+    def test_food_modifiers_are_kept(self):
+        for name in ("chicken salad", "tuna salad", "shrimp pasta", "beef noodles", "pepperoni pizza", "chocolate milk"):
+            with self.subTest(name=name):
+                self.assertEqual(canonical_food(name), name)
+
+    def test_descriptions_that_change_the_diet_are_kept(self):
+        self.assertEqual(canonical_food("Pasta (with meatballs)"), "pasta (with meatballs)")
+        self.assertEqual(canonical_food("pizza: with extra cheese"), "pizza")
+
+    def test_canonical_names_keep_the_verdict(self):
+        for name in ("chicken salad", "tuna salad", "shrimp pasta", "beef noodles", "pasta (with meatballs)",
+                     "pepperoni pizza", "grilled salmon", "Sausages: smoky"):
+            with self.subTest(name=name):
+                self.assertEqual(classify_foods(canonical_food(name)).verdict, classify_foods(name).verdict)
+
+
+class SearchConversationsTests(TestCase):
+    def search(self, query):
+        return [conversation.id for conversation in search_conversations(query)[0]]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        conversation = Conversation.objects.create(user_input="I love sausages", bot_response="Noted!")
+        self.assertEqual(self.search("sausage"), [conversation.id])
+        Conversation.objects.filter(id=conversation.id).update(user_input="I love tofu")
+        self.assertEqual(self.search("sausage"), [])
+        self.assertEqual(self.search("tofu"), [conversation.id])
+        conversation.delete()
+        self.assertEqual(self.search("tofu"), [])
+
+    def test_every_word_must_match(self):
+        both = Conversation.objects.create(user_input="pizza and pasta", bot_response="")
+        Conversation.objects.create(user_input="pizza and salad", bot_response="")
+        self.assertEqual(self.search("pasta pizza"), [both.id])
+
+    def test_user_input_matches_rank_above_bot_response_matches(self):
+        in_response = Conversation.objects.create(user_input="hello", bot_response="Do you like lentils?")
+        in_input = Conversation.objects.create(user_input="lentils", bot_response="Great choice!")
+        self.assertEqual(self.search("lentils"), [in_input.id, in_response.id])
+
+    def test_pages_cover_every_match_once_across_equal_scores(self):
+        # Identical texts score the same, so the cursor must break the tie on id
+        conversations = [Conversation.objects.create(user_input="rice", bot_response="") for _ in range(5)]
+        seen, cursor = [], None
+        while True:
+            rows, cursor = search_conversations("rice", cursor, 2)
+            seen.extend(row.id for row in rows)
+            if cursor is None:
+                break
+            self.assertEqual(decode_score_cursor(cursor)[1], rows[-1].id)
+        self.assertEqual(seen, [conversation.id for conversation in reversed(conversations)])
+
+    def test_malformed_cursors_are_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            search_conversations("rice", "bm8tc2VwYXJhdG9y")
+
+    def test_dropped_triggers_are_detected_and_recreated(self):
+        conversation = Conversation.objects.create(user_input="I love sausages", bot_response="")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER chatbot_conversation_fts_update")
+        self.assertEqual(missing_search_objects(), ["chatbot_conversation_fts_update"])
+        self.assertEqual([warning.id for warning in check_search_index(None, databases=["default"])], ["chatbot.W001"])
+        Conversation.objects.filter(id=conversation.id).update(user_input="I love tofu")
+        self.assertEqual(self.search("tofu"), [])   # The index went stale
+        self.assertEqual(repair_search_index(), ["chatbot_conversation_fts_update"])
+        self.assertEqual(missing_search_objects(), [])
+        self.assertEqual(self.search("tofu"), [conversation.id])
+        self.assertEqual(self.search("sausage"), [])
+
+    def test_unsupported_databases_get_a_501(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("search"))
+        with mock.patch.object(connections["default"], "vendor", "mysql"):
+            with self.assertRaises(SearchUnavailable):
+                search_conversations("rice")
+            with self.assertLogs("django.request", "ERROR"):
+                response = client.get("/api/search/", {"q": "rice"})
+        self.assertEqual(response.status_code, 501)
+
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class BatchClassificationTests(SimpleTestCase):
+    def test_string_ids_are_accepted(self):
+        content = json.dumps({"results": [{"id": "0", "label": "Vegan"}, {"id": 1, "label": "neither"}]})
+        self.assertEqual(parse_batch_response(content, {0, 1}), {0: "vegan", 1: "neither"})
+
+    def test_ambiguous_unknown_and_malformed_entries_are_dropped(self):
+        content = json.dumps({"results": [
+            {"id": 0, "label": "vegetarian or vegan"}, {"id": 1, "label": "vegetarian"}, {"id": "x", "label": "vegan"},
+            {"id": 7, "label": "vegan"}, "neither",
+        ]})
+        self.assertEqual(parse_batch_response(content, {0, 1}), {1: "vegetarian"})
+        self.assertEqual(parse_batch_response("not json", {0}), {})
+
+    def test_single_item_replies_are_normalized_to_a_label(self):
+        for reply, label in (("Vegetarian.", "vegetarian"), (" vegan\n", "vegan"), ("The foods are: neither", "neither"),
+                             ("non-vegetarian", None), ("vegetarian or vegan", None), ("I cannot tell", None)):
+            with self.subTest(reply=reply):
+                self.assertEqual(normalize_label(reply), label)
+
+    @override_settings(CLASSIFIER_BATCH_TOKEN_BUDGET=400, CLASSIFIER_BATCH_RETRIES=2)
+    def test_retries_halve_the_budget_then_fall_back_to_single_items(self):
+        async def acreate(**kwargs):
+            if "response_format" in kwargs:
+                return completion('{"results": []}')    # Every batch fails to parse
+            return completion("Vegetarian." if "cheese" in kwargs["messages"][1]["content"] else "no idea")
+
+        with mock.patch.object(classification, "chunk_by_token_budget", wraps=classification.chunk_by_token_budget) as chunk, \
+                self.assertLogs("chatbot.classification", "INFO"):
+            labels = async_to_sync(aclassify_batch)(["cheese and bread", "something else"], acreate)
+        self.assertEqual([call.args[1] for call in chunk.call_args_list], [400, 200, 100])
+        self.assertEqual(labels, ["vegetarian", None])
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches[response_cache.CACHE_ALIAS].clear()
+
+    def test_case_whitespace_numbering_and_order_share_a_key(self):
+        key = response_cache.cache_key("1. Pizza 2. pasta 3. salad", "gpt-test")
+        for user_input in ("salad, PASTA and pizza", "- pasta\n-   pizza\n- Salad"):
+            with self.subTest(user_input=user_input):
+                self.assertEqual(response_cache.cache_key(user_input, "gpt-test"), key)
+        self.assertNotEqual(response_cache.cache_key("pizza, pasta and rice", "gpt-test"), key)
+
+    def test_a_different_chatbot_model_misses(self):
+        async_to_sync(response_cache.aset_response)("pizza, pasta and salad", settings.CHATBOT_MODEL, "Yum!")
+        get = async_to_sync(response_cache.aget_response)
+        self.assertEqual(get("Salad, pizza and pasta", settings.CHATBOT_MODEL), "Yum!")
+        with override_settings(CHATBOT_MODEL="another-model"):
+            self.assertIsNone(get("Salad, pizza and pasta", settings.CHATBOT_MODEL))
+        self.assertEqual(response_cache.cache_stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+
+
+def sse_events(content):
+    """
+    :return: The (event, data) pairs of a server-sent event stream
+    """
+    events = []
+    for message in content.decode().strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+class ChatbotStreamTests(TestCase):
+    async def stream(self, user_input):
+        response = await self.async_client.post("/", {"user_input": user_input}, headers={"Accept": "text/event-stream"})
+        return sse_events(b"".join([chunk async for chunk in response.streaming_content]))
+
+    async def test_upstream_failure_ends_with_an_error_and_the_fallback(self):
+        async def astream(**kwargs):
+            yield "Hello, what "
+            raise ConnectionError("upstream closed the stream")
+
+        with mock.patch.object(llm, "astream", astream), self.assertLogs("chatbot.views", "ERROR"):
+            events = await self.stream("hello there")
+        self.assertEqual(events, [
+            ("message", {"token": "Hello, what "}),
+            ("error", {"error": "The reply was interrupted"}),
+            ("done", {"response": PROMPT_AGAIN_MESSAGE}),
+        ])
+        memory = ConversationMemory.from_session(await self.async_client.session.aget(SESSION_KEY))
+        self.assertEqual(memory.messages("next")[-2:-1], [{"role": "assistant", "content": PROMPT_AGAIN_MESSAGE}])
+
+
+class SimulationJobTests(TestCase):
+    def test_jobs_are_claimed_once_oldest_first(self):
+        first, second = enqueue_simulation(5), enqueue_simulation(5)
+        self.assertEqual(claim_next_job().id, first.id)
+        claimed = claim_next_job()
+        self.assertEqual((claimed.id, claimed.status), (second.id, SimulationJob.RUNNING))
+        self.assertIsNone(claim_next_job())
+
+    def test_only_stale_running_jobs_are_requeued_and_resume(self):
+        stale, fresh = enqueue_simulation(5), enqueue_simulation(5)
+        claim_next_job(), claim_next_job()
+        store_results(stale.id, 1, ["pizza"])
+        started_at = SimulationJob.objects.get(id=stale.id).started_at
+        SimulationJob.objects.filter(id=stale.id).update(updated_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_stale_jobs(60), 1)
+        self.assertEqual(SimulationJob.objects.get(id=fresh.id).status, SimulationJob.RUNNING)
+        resumed = claim_next_job()
+        self.assertEqual((resumed.id, resumed.completed, resumed.started_at), (stale.id, 1, started_at))
+
+    def test_status_reports_progress_and_results_since(self):
+        job = enqueue_simulation(4)
+        claim_next_job()
+        store_results(job.id, 1, ["pizza", "pasta"])
+        payload = self.client.get(f"/simulate/{job.id}/", {"since": 1}).json()
+        self.assertEqual({key: payload[key] for key in ("job_id", "status", "total", "completed", "progress", "error")},
+                         {"job_id": job.id, "status": "running", "total": 4, "completed": 2, "progress": 0.5, "error": ""})
+        self.assertEqual([result["answer"] for result in payload["results"]], ["pasta"])
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get(f"/simulate/{job.id}/", {"since": "x"}).status_code, 400)
+            self.assertEqual(self.client.get(f"/simulate/{job.id + 1}/").status_code, 404)
+
+    def test_simulate_queues_a_job(self):
+        response = self.client.post("/simulate/", {"count": 3})
+        self.assertEqual(response.status_code, 202)
+        job = SimulationJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual((job.status, job.total), (SimulationJob.QUEUED, 3))
+        self.assertEqual(response.json()["status_url"], f"/simulate/{job.id}/")
+
+
+class RequestMetricsTests(TestCase):
+    def requests_observed(self):
+        counts, total = metrics.REQUEST_DURATION.values.get(("chatbot", "POST"), ([0], 0.0))
+        return sum(counts), total
+
+    def test_metrics_expose_request_phase_and_query_series(self):
+        self.client.post("/", {"user_input": "pizza, pasta and salad"})
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        for series in ('chatbot_http_requests_total{view="chatbot",method="POST",status="200"}',
+                       'chatbot_http_request_duration_seconds_count{view="chatbot",method="POST"}',
+                       'chatbot_http_request_phase_duration_seconds_count{view="chatbot",phase="db"}',
+                       'chatbot_http_request_phase_duration_seconds_count{view="chatbot",phase="serialization"}',
+                       'chatbot_http_request_db_queries_count{view="chatbot"}'):
+            with self.subTest(series=series):
+                self.assertIn(f"\n{series} ", body)
+
+    async def test_streamed_responses_are_timed_until_their_last_chunk(self):
+        async def astream(**kwargs):
+            for token in ("Which ", "foods?"):
+                await asyncio.sleep(0.05)
+                yield token
+
+        count, total = self.requests_observed()
+        with mock.patch.object(llm, "astream", astream):
+            response = await self.async_client.post("/", {"user_input": "hello there"}, headers={"Accept": "text/event-stream"})
+            self.assertEqual(self.requests_observed(), (count, total))   # Not recorded before the stream is consumed
+            [chunk async for chunk in response.streaming_content]
+        new_count, new_total = self.requests_observed()
+        self.assertEqual(new_count, count + 1)
+        self.assertGreaterEqual(new_total - total, 0.1)
+
+
+class ConversationWriterTests(TransactionTestCase):
+    def writer(self, batch_size=100, max_attempts=3):
+        writer = write_behind.ConversationWriter(batch_size, interval=60, max_attempts=max_attempts)
+        self.addCleanup(writer.close)
+        return writer
+
+    def add(self, writer, count, **fields):
+        for i in range(count):
+            writer.add(["pizza", "pasta", "salad"], user_input=str(i), bot_response="", **fields)
+
+    def test_a_full_batch_is_written_by_the_background_thread(self):
+        writer = self.writer(batch_size=3)
+        self.add(writer, 2)
+        time.sleep(0.1)
+        self.assertEqual(Conversation.objects.count(), 0)   # Below the batch size, the interval has not elapsed
+        self.add(writer, 1)
+        deadline = time.monotonic() + 5
+        while writer.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with writer.flush_lock:     # Waits for the background flush that took the batch
+            self.assertEqual(Conversation.objects.count(), 3)
+        self.assertEqual(Conversation.objects.with_food("pasta").count(), 3)
+
+    def test_close_flushes_the_queue(self):
+        writer = self.writer()
+        self.add(writer, 2)
+        writer.close()
+        self.assertEqual(Conversation.objects.count(), 2)
+        with self.assertRaises(RuntimeError):
+            self.add(writer, 1)
+
+    def test_a_failing_batch_is_retried_then_written_row_by_row(self):
+        writer = self.writer(max_attempts=2)
+        self.add(writer, 1)
+        writer.add(["tofu"], user_input="bad", bot_response="", unknown_field=True)
+        self.add(writer, 1)
+        with self.assertLogs("chatbot.write_behind", "ERROR") as logs:
+            self.assertEqual(writer.flush(), 0)
+            self.assertEqual(len(writer.pending), 3)
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.pending, [])
+        self.assertEqual(sorted(Conversation.objects.values_list("user_input", flat=True)), ["0", "0"])
+        self.assertIn("Dropped a conversation", logs.output[-1])
+        self.add(writer, 1)
+        self.assertEqual(writer.flush(), 1)     # Later batches are written normally again
+
+    def test_lifespan_shutdown_closes_the_writer(self):
+        from food_chatbot.asgi import lifespan
+
+        sent = []
+
+        async def receive():
+            return {"type": "lifespan.shutdown"}
+
+        async def send(message):
+            sent.append(message)
+
+        with mock.patch.object(write_behind, "close_writer") as close_writer:
+            async_to_sync(lifespan)(receive, send)
+        close_writer.assert_called_once_with()
+        self.assertEqual(sent, [{"type": "lifespan.shutdown.complete"}])
+
+
+class StatCountersTests(TestCase):
+    def assertCountersMatch(self):
+        expected = +compute_counts()
+        self.assertEqual(stored_counts(), expected)
+        stats = dietary_stats(top_foods=100, days=366)
+        self.assertEqual(stats["total"], expected[StatCounter.TOTAL, ""])
+        self.assertEqual(stats["diets"], {diet: expected[StatCounter.DIET, diet] for diet in stats["diets"]})
+        self.assertEqual({food["name"]: food["count"] for food in stats["top_foods"]},
+                         {key: count for (dimension, key), count in expected.items() if dimension == StatCounter.FOOD})
+
+    def create(self, foods, bot_response, days_ago=0):
+        return Conversation.objects.create_with_foods(
+            foods, user_input=", ".join(foods), bot_response=bot_response, created_at=timezone.now() - timedelta(days=days_ago)
+        )
+
+    def exercise(self, step):
+        with step():
+            vegan = self.create(["tofu", "rice", "beans"], "1. tofu 2. rice 3. beans")
+            meat = self.create(["chicken", "rice", "cheese"], "1. chicken 2. rice 3. cheese", days_ago=1)
+            unknown = self.create(["gnocchi"], "Tell me more!", days_ago=2)
+        self.assertCountersMatch()
+
+        with step():
+            vegan.bot_response, vegan.is_vegetarian = "1. tofu 2. rice 3. cheese", not vegan.is_vegetarian
+            vegan.save()    # Moves the conversation from vegan to vegetarian
+        self.assertCountersMatch()
+
+        with step():
+            meat.delete()
+        self.assertCountersMatch()
+
+        with step():
+            Conversation.objects.bulk_create_with_foods([
+                (["pizza", "salad", "pasta"], {"user_input": "a", "bot_response": "1. pizza 2. salad 3. pasta"}),
+                (["beef", "rice", "tofu"], {"user_input": "b", "bot_response": "1. beef 2. rice 3. tofu",
+                                            "created_at": timezone.now() - timedelta(days=3)}),
+            ])
+        self.assertCountersMatch()
+
+        with step():
+            ConversationFood.objects.filter(conversation=unknown).delete()
+            Conversation.objects.filter(bot_response__contains="rice").delete()
+        self.assertCountersMatch()
+        self.assertEqual(Conversation.objects.count(), 2)
+
+    def test_counters_follow_every_change(self):
+        self.exercise(contextlib.nullcontext)
+
+    def test_counters_follow_every_change_inside_batched(self):
+        @contextlib.contextmanager
+        def step():
+            with transaction.atomic(), batched():
+                yield
+
+        self.exercise(step)
+
+    def test_nothing_is_applied_when_a_batch_raises(self):
+        self.create(["tofu"], "1. tofu")
+        with self.assertRaises(ValueError), transaction.atomic(), batched():
+            Conversation.objects.all().delete()
+            raise ValueError
+        self.assertCountersMatch()
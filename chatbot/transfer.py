@@ -0,0 +1,109 @@
+import csv
+import json
+
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_datetime
+
+from .models import Conversation, ConversationFood
+
+FORMATS = ('ndjson', 'csv')
+CSV_FIELDS = ['id', 'created_at', 'user_input', 'bot_response', 'is_vegetarian', 'foods']
+CSV_FOOD_SEPARATOR = '; '
+
+
+def detect_format(path, format=None):
+    """
+    Picks the file format from an explicit choice or the file extension.
+
+    :param path: The file path, or '-' for standard input/output
+    :param format: 'ndjson', 'csv' or None to detect it
+    :return: 'ndjson' or 'csv'
+    :raises ValueError: If the format cannot be determined
+    """
+    if format:
+        return format
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.ndjson', '.jsonl', '.json')) or path == '-':
+        return 'ndjson'
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+def iter_conversation_rows(chunk_size=2000, after_id=0):
+    """
+    Reads conversations in id order with a chunked iterator, fetching the foods of each chunk with one
+    prefetch query, so memory stays constant however many rows are exported.
+
+    :param chunk_size: The number of conversations fetched per database round-trip
+    :param after_id: Only conversations with a greater id are read
+    :return: A generator of dictionaries with the CSV_FIELDS keys
+    """
+    links = ConversationFood.objects.select_related('food').order_by('position')
+    conversations = Conversation.objects.filter(id__gt=after_id).order_by('id') \
+        .prefetch_related(Prefetch('food_links', queryset=links))
+    for conversation in conversations.iterator(chunk_size=chunk_size):
+        yield {
+            'id': conversation.id,
+            'created_at': conversation.created_at.isoformat(),
+            'user_input': conversation.user_input,
+            'bot_response': conversation.bot_response,
+            'is_vegetarian': conversation.is_vegetarian,
+            'foods': [link.food.name for link in conversation.food_links.all()],
+        }
+
+
+def write_rows(rows, stream, format):
+    """
+    Writes conversation rows to a text stream as NDJSON or CSV, one row at a time.
+
+    :param rows: An iterable of row dictionaries
+    :param stream: A writable text stream
+    :param format: 'ndjson' or 'csv'
+    :return: The number of rows written
+    """
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'foods': CSV_FOOD_SEPARATOR.join(row['foods'])})
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_rows(stream, format):
+    """
+    Reads conversation rows from a text stream one at a time. Only 'user_input' and 'bot_response' are
+    required; 'id' is ignored because imported conversations get new ids.
+
+    :param stream: A readable text stream
+    :param format: 'ndjson' or 'csv'
+    :return: A generator of (line number, foods, fields) tuples, fields being Conversation field values
+    :raises ValueError: If a row is malformed, with its line number
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        records = ((reader.line_num, row) for row in reader)
+    else:
+        records = ((number, line) for number, line in enumerate(stream, start=1) if line.strip())
+    for number, row in records:
+        try:
+            if format != 'csv':
+                row = json.loads(row)
+            foods = row.get('foods') or []
+            if isinstance(foods, str):
+                foods = [food for food in foods.split(CSV_FOOD_SEPARATOR.strip()) if food.strip()]
+            fields = {'user_input': row['user_input'], 'bot_response': row['bot_response']}
+            if row.get('is_vegetarian') not in (None, ''):
+                fields['is_vegetarian'] = row['is_vegetarian'] in (True, 'True', 'true', '1', 1)
+            if row.get('created_at'):
+                fields['created_at'] = parse_datetime(row['created_at'])
+                if fields['created_at'] is None:
+                    raise ValueError(f"invalid created_at {row['created_at']!r}")
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(f"Line {number}: {error}") from error
+        yield number, foods, fields
@@ -1,152 +1,413 @@
-from django.shortcuts import render
-from django.http import JsonResponse
-import openai
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
 import json
 import re
-import os
-from dotenv import load_dotenv
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Conversation
+from .models import Conversation, SimulationJob
 from .serializers import ConversationSerializer
+from .classification import aclassify_text, classify_conversations
+from .dietary import classify_foods
+from .jobs import enqueue_simulation
+from .memory import aload_memory, asave_memory
+from .search import SearchUnavailable, search_conversations
+from .stats import dietary_stats
+from .write_behind import asave_conversation
+from .parsing import confirmation_message, parse_foods
+from .pagination import InvalidCursor, decode_cursor, keyset_page
+from . import llm, metrics, response_cache
+from asgiref.sync import sync_to_async
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create your views here.
-load_dotenv()
-openai.api_key = settings.OPENAI_API_KEY # Use key from  settings
 
-def chatbot(request):
+PROMPT_AGAIN_MESSAGE = "Thanks for your input! Please provide exactly 3 favorite foods \
+            (e.g., '1. pizza, 2. pasta, 3. salad') for me to process."
+
+async def chatbot_llm_response(user_input, memory):
     """
-    Handles the chatbot interaction, processing user input via POST requests and returning a bot response.
-    If the input contains a valid list of 3 favorite foods, it saves the conversation to the database.
-    Otherwise, it prompts the user to provide a complete list.
+    Asks the LLM to respond to input the local parser could not handle, with the session's history.
+    First turns are served from the response cache when the same input was answered before.
 
-    :param request: The HTTP request object, expected to contain user_input in POST data
-    :return: A JsonResponse with the bot's response or a rendered HTML page for GET requests
+    :param user_input: The raw user input
+    :param memory: The session's ConversationMemory
+    :return: The bot's response text
     """
-    if request.method == "POST":
-        user_input = request.POST.get("user_input", "").strip()
-        prompt = (f"You are friendly chatbot. Ask the user: 'What are your top 3 favorite foods?' \
-        If they respond, thank them and list their foods (e.g., '1. food1, 2. food2, 3. food3'). \
-        If they don't  provide foods or the list is incomplete, gently prompt again. User said: {user_input}")
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",  # Specifies the OpenAI model to use for generating responses
-            messages=[{"role": "user", "content": prompt}], # Sends the prompt to the model
+    cacheable = memory.is_empty # Later replies depend on the history, so only first turns are cached
+    bot_response = await response_cache.aget_response(user_input, settings.CHATBOT_MODEL) if cacheable else None
+    if bot_response is None:
+        response = await llm.acreate(
+            model=settings.CHATBOT_MODEL,  # Specifies the OpenAI model to use for generating responses
+            messages=memory.messages(user_input),  # Sends the system prompt, the history and the user's input
             max_tokens=150  # Limits the response length to 150 tokens
         )
-
         bot_response = response.choices[0].message.content.strip()  # Extracts the bot's response from the API call
+        if cacheable:
+            await response_cache.aset_response(user_input, settings.CHATBOT_MODEL, bot_response)
+    return bot_response
+
+def parse_turn(user_input, memory):
+    """
+    Parses a well-formed list of 3 foods, given in this input or in pieces over the session's last few inputs.
+
+    :param user_input: The raw user input
+    :param memory: The session's ConversationMemory
+    :return: A (foods, conversation_input) tuple; foods is None if no list was found, and conversation_input
+             is the text saved with the conversation, which joins the pieces of a list given in several turns
+    """
+    foods = parse_foods(user_input)
+    if foods:
+        return foods, user_input
+    return memory.parse_pieces(user_input)
+
+async def finish_conversation(user_input, bot_response, foods):
+    """
+    Saves the conversation if exactly 3 favorite foods were found, either by the local parser or in the bot's response.
+
+    :param user_input: The raw user input
+    :param bot_response: The bot's response text
+    :param foods: The foods parsed from the user input, or None if it was not a well-formed list
+    :return: A (response, saved) tuple: the response to show the user, which is the bot's response or, if it is
+             empty, a prompt to provide a complete list, and whether the conversation was saved
+    """
+    if not foods:
         foods = []
         if user_input and any(str(i) in user_input for i in range(1,4)):
             # Checks if user input contains numbered items (1-3)
             # Extract foods if numbered list is detected
             food_matches = re.findall(r'(?:\d+\.|-)\s*([^\d\n]+)', bot_response)
             foods = [food.strip() for food in food_matches[:3]] # Limits to top 3 foods and cleans them
-        if foods and len(foods) == 3:
-            # Validates that exactly 3 foods were extracted
-            Conversation.objects.create(
-                user_input=user_input,  # Saves the user's input
-                bot_response=bot_response,  # Saves the bot's response
-                favorite_foods=json.dumps(foods),   # Converts the foods list to a JSON string for storage
-                is_vegetarian=check_vegetarian(foods)   # Determines if the foods are vegetarian using a custom function
-            )
+    if foods and len(foods) == 3:
+        # Validates that exactly 3 foods were extracted
+        is_vegetarian = await check_vegetarian(foods)   # Classifies the foods as given; they are canonicalized only for storage
+        await asave_conversation(
+            foods,  # Links the foods to the conversation as normalized Food rows
+            user_input=user_input,  # Saves the user's input
+            bot_response=bot_response,  # Saves the bot's response
+            is_vegetarian=is_vegetarian
+        )
+        return bot_response, True
+    # The bot's reply asks for the missing foods with the session's history in mind; the fixed prompt is a fallback
+    return bot_response or PROMPT_AGAIN_MESSAGE, False
+
+def sse_event(data, event=None):
+    """
+    Formats a server-sent event carrying JSON data.
+
+    :param data: The JSON-serializable payload
+    :param event: An optional event name; unnamed events are 'message' events
+    :return: The event as text, terminated by a blank line
+    """
+    prefix = f"event: {event}\n" if event else ""
+    with metrics.timed("serialization"):
+        return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def stream_chatbot_response(request, user_input, memory):
+    """
+    Streams the chatbot's reply as server-sent events: a 'message' event with each token as it arrives,
+    then a 'done' event with the final response once the conversation has been saved. If the LLM call fails
+    partway through, an 'error' event tells the browser to discard the partial reply, and the turn is finished
+    with the fallback prompt like an empty reply. The session is saved once the reply is complete, since the
+    session middleware has already run when the stream starts.
+
+    :param request: The HTTP request object, whose session holds the conversation memory
+    :param user_input: The raw user input
+    :param memory: The session's ConversationMemory
+    :return: An async generator of server-sent events
+    """
+    foods, conversation_input = parse_turn(user_input, memory)
+    if foods:
+        bot_response = confirmation_message(foods)
+        yield sse_event({"token": bot_response})
+    else:
+        cacheable = memory.is_empty
+        bot_response = await response_cache.aget_response(user_input, settings.CHATBOT_MODEL) if cacheable else None
+        if bot_response is not None:
+            yield sse_event({"token": bot_response})
+        else:
+            tokens = []
+            try:
+                async for token in llm.astream(model=settings.CHATBOT_MODEL, messages=memory.messages(user_input), max_tokens=150):
+                    tokens.append(token)
+                    yield sse_event({"token": token})   # Forwards each token to the browser as soon as it arrives
+            except Exception:
+                logger.exception("Streaming the chatbot reply failed")
+                yield sse_event({"error": "The reply was interrupted"}, event="error")
+                bot_response = ""   # The partial reply is discarded, so finish_conversation() falls back to the prompt
+            else:
+                bot_response = "".join(tokens).strip()
+                if cacheable:
+                    await response_cache.aset_response(user_input, settings.CHATBOT_MODEL, bot_response)
+    bot_response, saved = await finish_conversation(conversation_input, bot_response, foods)
+    await memory.aremember(user_input, bot_response, completed=saved)
+    await asave_memory(request, memory)
+    await request.session.asave()
+    yield sse_event({"response": bot_response}, event="done")
+
+async def chatbot(request):
+    """
+    Handles the chatbot interaction, processing user input via POST requests and returning a bot response.
+    Well-formed lists of 3 favorite foods are parsed and confirmed locally, including lists given in pieces
+    over several turns; other input goes to the LLM along with the session's history, which is kept within
+    a token window by summarizing older turns. If a valid list of 3 favorite foods is found, it saves the
+    conversation to the database. The view is async so a worker served through ASGI keeps serving other
+    requests while the LLM call is in flight.
+
+    Requests sent with 'Accept: text/event-stream' receive the reply as server-sent events, token by token.
+
+    :param request: The HTTP request object, expected to contain user_input in POST data
+    :return: A JsonResponse with the bot's response, a StreamingHttpResponse of server-sent events,
+             or a rendered HTML page for GET requests
+    """
+    if request.method == "POST":
+        user_input = request.POST.get("user_input", "").strip()
+        memory = await aload_memory(request)
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            if request.session.session_key is None:
+                await request.session.acreate()  # Sets the session cookie before the stream starts
+            response = StreamingHttpResponse(stream_chatbot_response(request, user_input, memory), content_type="text/event-stream")
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"    # Stops reverse proxies from buffering the stream
+            return response
+        foods, conversation_input = parse_turn(user_input, memory)
+        if foods:
+            # Well-formed lists of three foods are confirmed locally without an LLM round-trip
+            bot_response = confirmation_message(foods)
         else:
-            bot_response = "Thanks for your input! Please provide exactly 3 favorite foods \
-            (e.g., '1. pizza, 2. pasta, 3. salad') for me to process."  # Prompts user for correct input
-        return JsonResponse({"response": bot_response}) # Returns the bot's response as JSON
+            bot_response = await chatbot_llm_response(user_input, memory)
+        bot_response, saved = await finish_conversation(conversation_input, bot_response, foods)
+        await memory.aremember(user_input, bot_response, completed=saved)
+        await asave_memory(request, memory)
+        with metrics.timed("serialization"):
+            return JsonResponse({"response": bot_response}) # Returns the bot's response as JSON
     return render(request, 'chatbot.html', {"initial_message": "Welcome! Please enter your top 3 favorite foods."}) # Renders the chatbot HTML page with an initial message for GET requests
 
-def check_vegetarian(foods):
+async def check_vegetarian(foods):
     """
-    Determines if a list of foods is vegetarian by checking against a set of non-vegetarian keywords.
+    Determines if a list of foods is vegetarian using the compiled dietary vocabulary,
+    falling back to the LLM classifier only when none of the foods is a known food term.
 
     :param foods: A list of food items to evaluate
     :return: Boolean indicating whether all foods are vegetarian (True) or contain non-vegetarian items (False)
     """
-    non_veg_keywords = ["chicken", "beef", "pork", "fish", "shrimp", "lamb", "turkey", "duck", "venison", "goat",
-                        "rabbit", "veal", "bacon", "sausage", "ham", "salami", "prosciutto", "crab", "lobster",
-                        "squid", "octopus", "clams", "mussels", "oysters", "scallops", "gelatin", "broth", "stock",
-                        "lard", "suet", "tallow", "meat", "seafood", "poultry", "game"]
-
-    for food in foods:
-        food_lower = food.lower()
-        if any(keyword in food_lower for keyword in non_veg_keywords):
-            # Checks if any non-vegetarian keyword is present in the food
-            return False
-    return True
+    text = ", ".join(foods)
+    verdict = classify_foods(text).verdict
+    if verdict is None:
+        verdict = await aclassify_text(text)
+    return verdict in ('vegetarian', 'vegan')
 
 def simulate_conversation(request):
     """
-    Simulates 100 conversations by repeatedly asking an AI model for the user's top 3 favorite foods
-    and collects the responses for analysis or testing purposes.
+    Queues a background job simulating conversations that ask an AI model for the user's top 3 favorite foods.
+    The job is run by the run_simulation_jobs management command, so the request returns immediately
+    and progress is polled from the returned status URL.
 
-    :param request: The HTTP request object, expected to be a POST request to trigger the simulation
-    :return: A JsonResponse containing a list of dictionaries with iteration number, question, and AI response
+    :param request: The HTTP request object, expected to be a POST request with an optional 'count' of conversations
+    :return: A JsonResponse with status 202 containing the job id and its status URL
 
     Note: This function assumes a POST request; other methods (e.g., GET) are not handled and will result in no response
     """
     if request.method == "POST":
-        results = []
-        for i in range(100):
-            question = "What are your top 3 favorite foods?"
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": question}],
-                max_tokens=100
-            )
-            answers = response.choices[0].message.content.strip()
-            results.append({"iteration": i+1, "question": question, "answer": answer})
-        return JsonResponse({"results": results})
+        try:
+            count = int(request.POST.get("count", settings.SIMULATION_JOB_DEFAULT_SIZE))
+        except ValueError:
+            return JsonResponse({"error": "count must be an integer"}, status=400)
+        if not 1 <= count <= settings.SIMULATION_JOB_MAX_SIZE:
+            return JsonResponse({"error": f"count must be between 1 and {settings.SIMULATION_JOB_MAX_SIZE}"}, status=400)
+        job = enqueue_simulation(count)
+        status_url = reverse('simulation_job_status', args=[job.id])
+        return JsonResponse({"job_id": job.id, "status": job.status, "status_url": status_url}, status=202)
+
+def simulation_job_status(request, job_id):
+    """
+    Reports the progress of a simulation job and the results stored so far.
+
+    :param request: The HTTP request object; the optional 'since' query parameter skips results up to that iteration,
+                    so pollers only fetch new results
+    :param job_id: The id of the simulation job
+    :return: A JsonResponse with the job status, progress and results, with status 404 if the job does not exist
+    """
+    job = get_object_or_404(SimulationJob, id=job_id)
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        return JsonResponse({"error": "since must be an integer"}, status=400)
+    results = list(job.results.filter(iteration__gt=since).order_by('iteration').values('iteration', 'question', 'answer'))
+    return JsonResponse({
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "progress": job.completed / job.total if job.total else 1.0,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "results": results,
+    })
+
+def classified_page(cursor, page_size):
+    """
+    Classifies one keyset page of conversations and serializes those classified as vegetarian or vegan.
+
+    :param cursor: The cursor returned with the previous page, or None for the first page
+    :param page_size: The number of conversations to read for this page
+    :return: A (results, next_cursor) tuple; each result is serialized conversation data with its classification
+    """
+    conversations, next_cursor = keyset_page(
+        Conversation.objects.only('id', 'created_at', 'user_input', 'bot_response'), cursor, page_size
+    )
+    # Classifies locally where possible, then serves stored classifications and only sends new or stale responses to the LLM
+    classifications = classify_conversations(conversations)
+
+    results = []
+    for conv in conversations:
+        classification = classifications[conv.id]
+        if classification in ('vegetarian', 'vegan'):
+            with metrics.timed("serialization"):
+                data = ConversationSerializer(conv).data    # Serializes the conversation object
+            data['classification'] = classification # Adds the classification to the serialized data
+            results.append(data)
+    return results, next_cursor
+
+async def stream_classified(cursor, page_size):
+    """
+    Yields classified conversations as NDJSON lines, one page at a time, so only a single page is held in memory.
+
+    :param cursor: The cursor to start from, or None to start at the oldest conversation
+    :param page_size: The number of conversations read per page
+    :return: An async generator of JSON lines
+    """
+    while True:
+        results, cursor = await sync_to_async(classified_page)(cursor, page_size)
+        for data in results:
+            with metrics.timed("serialization"):
+                line = json.dumps(data) + "\n"
+            yield line
+        if cursor is None:
+            break
 
 @api_view(['GET'])
 def vegetarian_users_api(request):
     """
     API endpoint to retrieve a list of users classified as vegetarian or vegan based on their favorite foods.
-    Uses OpenAI to classify conversation responses and returns the results in a JSON format.
+    Responses are classified with the local dietary vocabulary first; those without known food terms are served
+    from the Classification table, and OpenAI is only called for responses that are new or were classified by an
+    older classifier version.
+
+    Conversations are read in keyset pages ordered by (created_at, id). Pass the returned 'next_cursor' as the
+    'cursor' query parameter to fetch the next page, and 'page_size' to change the page size. With 'stream=true'
+    every page is classified and written as NDJSON as soon as it is ready, so memory stays constant.
 
     :param request: The HTTP GET request object, authenticated via Basic Authentication
-    :return: A Response object containing two lists: 'vegetarian_users' and 'vegan_users' with serialized data
-    :raises: HTTP 500 if OpenAI API call or serialization fails
+    :return: A Response object containing two lists: 'vegetarian_users' and 'vegan_users' with serialized data,
+             plus 'next_cursor', or an NDJSON StreamingHttpResponse when stream=true
+    :raises: HTTP 400 if the cursor or page size is invalid, HTTP 500 if OpenAI API call or serialization fails
     """
-    # Define vegetarian/vegan foods
-    vegetarian_foods = {'tofu', 'salad', 'lentils', 'pasta', 'rice', 'vegetables', 'mango', 'kiwi', 'chia', 'bulgur', 'corn'}
-    non_vegetarian_foods = {'chicken', 'beef', 'pork', 'fish', 'meat'}
-    non_vegan_foods = {'eggs', 'dairy', 'cheese', 'milk', 'butter', 'honey', 'cream'}
+    cursor = request.query_params.get('cursor')
+    try:
+        if cursor:
+            decode_cursor(cursor)   # Validates the cursor before any response, including a stream, is started
+    except InvalidCursor as error:
+        return Response({"error": str(error)}, status=400)
+    try:
+        page_size = int(request.query_params.get('page_size', settings.VEGETARIAN_API_PAGE_SIZE))
+    except ValueError:
+        return Response({"error": "page_size must be an integer"}, status=400)
+    if not 1 <= page_size <= settings.VEGETARIAN_API_MAX_PAGE_SIZE:
+        return Response({"error": f"page_size must be between 1 and {settings.VEGETARIAN_API_MAX_PAGE_SIZE}"}, status=400)
 
-    conversations = Conversation.objects.all()
-    logger.info(f"Conversations: {conversations}")
+    if request.query_params.get('stream', '').lower() in ('1', 'true'):
+        return StreamingHttpResponse(stream_classified(cursor, page_size), content_type="application/x-ndjson")
 
-    vegetarian_list = []
-    vegan_list = []
-    for conv in conversations:
-        logger.info(f"Processing: {conv.bot_response}")
-        # Use OpenAI to classify
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Analyze the following list of favorite foods and determine if it is vegetarian, vegan, or neither. Respond strictly only 'vegetarian', 'vegan', or 'neither'."},
-                {"role": "user", "content": conv.bot_response}
-            ],
-            max_tokens=10,  # Limits the response to 10 tokens for efficiency
-            temperature = 0 # Sets temperature to 0 for deterministic output
-        )
-        classification = response.choices[0].message.content.strip().lower()
-        logger.info(f"Classification for {conv.bot_response}: {classification}")
-
-        # if hasattr(conv, 'is_vegetarian'):
-        #     conv.is_vegetarian = classification in ['vegetarian', 'vegan']
-        #     conv.save()
-
-        serializer = ConversationSerializer(conv)   # Serializes the conversation object
-        data = serializer.data  # Gets the serialized data
-        data['classification'] = classification # Adds the classification to the serialized data
-        if classification == 'vegetarian':
-            vegetarian_list.append(data)
-        elif classification == 'vegan':
-            vegan_list.append(data)
-
-    return Response({"vegetarian_users": vegetarian_list, "vegan_users": vegan_list})
\ No newline at end of file
+    results, next_cursor = classified_page(cursor, page_size)
+    vegetarian_list = [data for data in results if data['classification'] == 'vegetarian']
+    vegan_list = [data for data in results if data['classification'] == 'vegan']
+    return Response({"vegetarian_users": vegetarian_list, "vegan_users": vegan_list, "next_cursor": next_cursor})
+
+@api_view(['GET'])
+def response_cache_stats_api(request):
+    """
+    API endpoint reporting the chatbot response cache hit and miss counters.
+
+    :param request: The HTTP GET request object, authenticated via Basic Authentication
+    :return: A Response object with 'hits', 'misses' and 'hit_rate'
+    """
+    return Response(response_cache.cache_stats())
+
+@api_view(['GET'])
+def dietary_stats_api(request):
+    """
+    API endpoint serving dashboard statistics: conversation counts per diet class, the most popular foods and
+    daily buckets. They are read from counters maintained as conversations are saved and deleted, so the cost
+    does not grow with the number of conversations and no LLM call is made.
+
+    :param request: The HTTP GET request object, authenticated via Basic Authentication; 'foods' sets how many
+                    popular foods and 'days' how many daily buckets are returned
+    :return: A Response object with 'total', 'diets', 'top_foods' and 'daily'
+    :raises: HTTP 400 if 'foods' or 'days' is not an integer in range
+    """
+    try:
+        top_foods = int(request.query_params.get('foods', 10))
+        days = int(request.query_params.get('days', 30))
+    except ValueError:
+        return Response({"error": "foods and days must be integers"}, status=400)
+    if not 1 <= top_foods <= 100 or not 1 <= days <= 366:
+        return Response({"error": "foods must be between 1 and 100 and days between 1 and 366"}, status=400)
+    return Response(dietary_stats(top_foods, days))
+
+@api_view(['GET'])
+def search_conversations_api(request):
+    """
+    API endpoint for full-text search over past conversations, e.g. to find users who mentioned a food.
+    Conversations containing every word of 'q' in their user input or bot response are returned best match
+    first, read from a full-text index so the cost depends on the number of matches rather than of conversations.
+    Pass the returned 'next_cursor' as the 'cursor' query parameter to fetch the next page.
+
+    :param request: The HTTP GET request object, authenticated via Basic Authentication; 'q' is the search text,
+                    'cursor' the cursor of the previous page and 'page_size' the number of results per page
+    :return: A Response object with 'query', 'next_cursor' (None on the last page) and 'results'
+    :raises: HTTP 400 if 'q' is missing, the cursor is invalid or 'page_size' is not an integer in range,
+             HTTP 501 if the database has no full-text search index
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({"error": "q is required"}, status=400)
+    try:
+        page_size = int(request.query_params.get('page_size', settings.SEARCH_API_PAGE_SIZE))
+    except ValueError:
+        return Response({"error": "page_size must be an integer"}, status=400)
+    if not 1 <= page_size <= settings.SEARCH_API_MAX_PAGE_SIZE:
+        return Response({"error": f"page_size must be between 1 and {settings.SEARCH_API_MAX_PAGE_SIZE}"}, status=400)
+
+    try:
+        conversations, next_cursor = search_conversations(query, request.query_params.get('cursor'), page_size)
+    except InvalidCursor as error:
+        return Response({"error": str(error)}, status=400)
+    except SearchUnavailable as error:
+        return Response({"error": str(error)}, status=501)
+    results = [{
+        "id": conversation.id,
+        "user_input": conversation.user_input,
+        "bot_response": conversation.bot_response,
+        "is_vegetarian": conversation.is_vegetarian,
+        "created_at": conversation.created_at,
+        "foods": [link.food.name for link in conversation.food_links.all()],
+        "score": conversation.score,
+    } for conversation in conversations]
+    return Response({"query": query, "next_cursor": next_cursor, "results": results})
+
+def metrics_view(request):
+    """
+    Serves request, LLM and cache metrics in the Prometheus text exposition format, for scraping and alerting
+    on latency and LLM spend per endpoint. Each worker process serves its own metrics.
+
+    :param request: The HTTP GET request object
+    :return: An HttpResponse with the exposition text
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,184 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+from .dietary import _forms, classify_foods
+
+# The canonical names foods are stored under, also the foods the conversation simulator picks from
+CANONICAL_FOODS = (
+    "pizza", "chicken", "beef", "salad", "tofu", "lentils", "pasta", "rice",
+    "broccoli", "carrots", "spinach", "quinoa", "eggs", "fish", "shrimp", "turkey",
+    "avocado", "cheese", "bread", "beans", "potatoes", "sweet potatoes", "mushrooms",
+    "cucumber", "tomatoes", "oranges", "apples", "bananas", "berries", "yogurt", "oats",
+    "peanut butter", "almonds", "cashews", "walnuts", "hummus", "zucchini", "cauliflower",
+    "brussels sprouts", "asparagus", "onions", "garlic", "peppers", "corn", "peas",
+    "cabbage", "eggplant", "pineapple", "grapes", "melon", "cherries", "kiwi",
+    "mango", "papaya", "coconut", "figs", "dates", "raisins", "cranberries", "blueberries",
+    "sardines", "salmon", "tuna", "duck", "pork", "bacon", "sausages", "lamb",
+    "barley", "millet", "couscous", "bulgur", "buckwheat", "noodles", "gnocchi",
+    "tortilla", "pita", "bagel", "croissant", "pancakes", "waffles", "cereal",
+    "milk", "cream", "butter", "ice cream", "gelato", "chocolate", "jam", "honey",
+    "maple syrup", "soy milk", "almond milk", "coconut milk", "chia seeds", "flax seeds",
+    "sunflower seeds", "pumpkin seeds", "tempeh", "seitan", "clams", "scallops", "lobster",
+)
+
+# Where a food name turns into a description, e.g. 'Pizza: I love the crust' or 'pasta - with pesto'
+DESCRIPTION_PATTERN = re.compile(r"\s*(?:[:(\[,;!?–—]|\s-\s|\.(?:\s|$)).*$", re.DOTALL)
+ARTICLE_PATTERN = re.compile(r"^(?:(?:a|an|the|some|my)\s+)+")
+MIN_FUZZY_LENGTH = 5    # Shorter names only match exactly, since one typo can turn them into another food
+
+
+def singular_stems(name):
+    """
+    :param name: A canonical food name, in singular or plural form
+    :return: The set of the name and its singular, e.g. {'carrots', 'carrot'}
+    """
+    stems = {name}
+    if name.endswith("ies"):
+        stems.add(name[:-3] + "y")  # e.g. berries -> berry
+    elif re.search(r"(?:s|x|z|ch|sh|o)es$", name):
+        stems.add(name[:-2])    # e.g. potatoes -> potato
+    elif name.endswith("s") and not name.endswith("ss"):
+        stems.add(name[:-1])    # e.g. carrots -> carrot
+    return stems
+
+
+def singular_forms(name):
+    """
+    Generates the singular and plural spellings of a vocabulary name, which may be given in either form.
+    They include regular inflections that are not words, such as 'beefs'.
+
+    :param name: A canonical food name
+    :return: A set of lower-case spellings
+    """
+    return {form for stem in singular_stems(name) for form in _forms(stem)}
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Computes the Levenshtein distance between two strings, giving up once it exceeds limit.
+
+    :return: The distance, or limit + 1 if it is greater than limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FoodIndex:
+    """
+    An in-memory index of every spelling of the canonical foods: an exact map for case and plural
+    variants, and a trigram index that narrows typo matching down to a few candidates checked by edit distance.
+    Typos are only matched against the names and their singulars, since a generated inflection such as
+    'beefs' is one edit away from other foods, e.g. 'beets'.
+    """
+    def __init__(self, foods):
+        self.spellings = {}     # Spelling -> canonical name
+        for food in foods:
+            for spelling in sorted(singular_forms(food)):
+                self.spellings.setdefault(spelling, food)
+        self.postings = {}      # Trigram -> name or singular containing it
+        for spelling in sorted({stem for food in foods for stem in singular_stems(food)}):
+            for gram in trigrams(spelling):
+                self.postings.setdefault(gram, []).append(spelling)
+
+    def fuzzy(self, text, candidates=5):
+        """
+        Finds the canonical food whose spelling is closest to text, allowing one typo in names of five letters
+        or more and two from ten letters.
+
+        :param text: A cleaned, lower-case food name
+        :param candidates: How many spellings sharing the most trigrams with text are checked
+        :return: The canonical name, or None if no spelling is close enough
+        """
+        if len(text) < MIN_FUZZY_LENGTH:
+            return None
+        limit = 1 if len(text) < 10 else 2
+        shared = Counter(spelling for gram in trigrams(text) for spelling in self.postings.get(gram, ()))
+        best = None
+        for spelling, _ in shared.most_common(candidates):
+            distance = edit_distance(text, spelling, limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, spelling)
+        return self.spellings[best[1]] if best else None
+
+    def mentions_food(self, text):
+        """
+        :param text: A cleaned, lower-case text
+        :return: Whether the text names a food: a dietary vocabulary term, or a word that is, or is a typo of, a canonical food
+        """
+        return classify_foods(text).verdict is not None or any(word in self.spellings or self.fuzzy(word) for word in text.split())
+
+    def lookup(self, text):
+        """
+        Matches a cleaned food name against the vocabulary: the whole name first, then without leading words
+        that name no food, e.g. 'grilled salmon' -> 'salmon', exactly before allowing typos. Names qualified by
+        another food, such as 'chicken salad' or 'chocolate milk', are not in the vocabulary.
+
+        :param text: A cleaned, lower-case food name
+        :return: The canonical name, or None if the name is not in the vocabulary
+        """
+        words = text.split()
+        suffixes = [text]
+        for start in range(1, len(words)):
+            if self.mentions_food(" ".join(words[:start])):
+                break
+            suffixes.append(" ".join(words[start:]))
+        for suffix in suffixes:
+            if suffix in self.spellings:
+                return self.spellings[suffix]
+        for suffix in suffixes:
+            match = self.fuzzy(suffix)
+            # A known food is never corrected into a food of another diet, e.g. 'goats' into 'oats'
+            if match and classify_foods(suffix).verdict in (None, classify_foods(match).verdict):
+                return match
+        return None
+
+
+@lru_cache(maxsize=1)
+def food_index():
+    """
+    :return: The FoodIndex of CANONICAL_FOODS, built on first use and shared by the process
+    """
+    return FoodIndex(CANONICAL_FOODS)
+
+
+def clean_food_name(name):
+    """
+    Lower-cases a food name, drops leading articles and a trailing description, and collapses whitespace.
+    A description that changes the diet of the name, as in 'pasta (with meatballs)', is kept.
+
+    :param name: The food name as entered or extracted
+    :return: The cleaned name
+    """
+    text = " ".join(name.lower().split()).strip(" .,;:!*-")
+    stripped = DESCRIPTION_PATTERN.sub("", text)
+    if classify_foods(stripped).verdict == classify_foods(text).verdict:
+        text = stripped
+    return ARTICLE_PATTERN.sub("", text).strip(" .,;:!*-")
+
+
+@lru_cache(maxsize=4096)
+def canonical_food(name):
+    """
+    Maps a food name to its canonical vocabulary name, so 'Sausages', 'sausage', 'sausges' and
+    'Sausages: smoky and spicy' are all stored as 'sausages'. Names outside the vocabulary are kept cleaned.
+
+    :param name: The food name as entered or extracted
+    :return: The canonical name
+    """
+    text = clean_food_name(name) or " ".join(name.lower().split())
+    return food_index().lookup(text) or text
@@ -0,0 +1,174 @@
+import atexit
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationWriter:
+    """
+    Buffers conversation inserts off the request path and writes them with bulk_create_with_foods, once
+    batch_size conversations are waiting or every interval seconds, from a background thread. Fewer, larger
+    write transactions keep several workers from stalling each other on SQLite's single writer lock.
+
+    A batch that keeps failing is written one conversation at a time after max_attempts flushes, so one bad row
+    cannot block every later write. The buffer is flushed by close(), which runs at ASGI lifespan shutdown and
+    at interpreter exit, so a worker shutting down gracefully does not lose conversations. Conversations are
+    not visible to queries until they are flushed.
+    """
+    def __init__(self, batch_size, interval, max_attempts=3):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.failures = 0   # Consecutive flushes that failed to write the queued batch
+        self.pending = []   # (foods, fields) tuples waiting to be written
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Serializes flushes from the background thread and close()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="conversation-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, foods, **fields):
+        """
+        Queues a conversation for insertion. Never touches the database, so it is safe to call from async code.
+
+        :param foods: A list of food names in the order the user gave them
+        :param fields: The Conversation field values
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The conversation writer is closed")
+            self.pending.append((foods, fields))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        """
+        Writes every queued conversation. A batch that fails to write is put back at the front of the queue
+        and retried on the next flush; on its max_attempts-th failure its conversations are written one by one
+        instead, and those that still fail are logged and dropped.
+
+        :return: The number of conversations written
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                Conversation.objects.bulk_create_with_foods(batch)
+            except Exception:
+                self.failures += 1
+                if self.failures < self.max_attempts:
+                    logger.exception(f"Failed to write {len(batch)} conversations, retrying on the next flush")
+                    with self.lock:
+                        self.pending[:0] = batch
+                    return 0
+                logger.exception(f"Failed to write {len(batch)} conversations {self.failures} times, writing them one by one")
+                self.failures = 0
+                return self.write_each(batch)
+            self.failures = 0
+            return len(batch)
+
+    def write_each(self, batch):
+        """
+        Writes conversations one at a time, dropping those that fail.
+
+        :param batch: A list of (foods, fields) tuples
+        :return: The number of conversations written
+        """
+        written = 0
+        for foods, fields in batch:
+            try:
+                Conversation.objects.create_with_foods(foods, **fields)
+            except Exception:
+                logger.exception(f"Dropped a conversation that could not be written: foods={foods!r}, fields={fields!r}")
+            else:
+                written += 1
+        return written
+
+    def run(self):
+        while not self.closed:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.closed:
+                break
+            self.flush()
+            close_old_connections() # Drops the thread's connection once it is older than CONN_MAX_AGE or unusable
+
+    def close(self):
+        """
+        Stops the background thread and writes whatever is still queued.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.wakeup.set()
+        self.thread.join(timeout=self.interval + 5)
+        self.flush()
+        if self.pending:
+            logger.error(f"Lost {len(self.pending)} conversations that could not be written at shutdown")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """
+    Returns the process's conversation writer, starting it on first use. It is started lazily so every
+    worker forked by gunicorn runs its own background thread.
+
+    :return: The ConversationWriter
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ConversationWriter(settings.CONVERSATION_WRITE_BEHIND_BATCH_SIZE, settings.CONVERSATION_WRITE_BEHIND_INTERVAL,
+                                         settings.CONVERSATION_WRITE_BEHIND_MAX_ATTEMPTS)
+            atexit.register(_writer.close)
+        return _writer
+
+
+def close_writer():
+    """
+    Flushes and stops the process's conversation writer, if it was started.
+    """
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.close()
+
+
+def save_conversation(foods, **fields):
+    """
+    Saves a conversation with its foods: queued for the background writer when CONVERSATION_WRITE_BEHIND
+    is enabled, otherwise written immediately.
+
+    :param foods: A list of food names in the order the user gave them
+    :param fields: The Conversation field values
+    """
+    if settings.CONVERSATION_WRITE_BEHIND:
+        get_writer().add(foods, **fields)
+    else:
+        Conversation.objects.create_with_foods(foods, **fields)
+
+
+async def asave_conversation(foods, **fields):
+    """
+    Async version of save_conversation(). Queuing a conversation needs no database access, so only
+    immediate writes are run in a thread.
+    """
+    if settings.CONVERSATION_WRITE_BEHIND:
+        get_writer().add(foods, **fields)
+    else:
+        await sync_to_async(Conversation.objects.create_with_foods)(foods, **fields)
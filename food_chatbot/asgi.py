@@ -9,8 +9,35 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "food_chatbot.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chatbot import llm, write_behind  # Imported once get_asgi_application() has set Django up
+
+
+async def lifespan(receive, send):
+    """
+    Handles the ASGI lifespan protocol, which Django does not implement. At startup the LLM client of the
+    worker's event loop is created and connected, so the first user request does not pay for it. At shutdown
+    the conversations queued by the write-behind writer are flushed.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await llm.awarm_up()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await sync_to_async(write_behind.close_writer)()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 
@@ -23,6 +24,68 @@ load_dotenv(BASE_DIR / ".env")
 # GET OpenAI API Key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Models used by the chatbot view and by conversation simulation
+CHATBOT_MODEL = os.getenv("CHATBOT_MODEL", "gpt-3.5-turbo")
+SIMULATION_MODEL = os.getenv("SIMULATION_MODEL", "gpt-3.5-turbo")
+
+# Estimated tokens of chat history (summary plus recent turns) sent with each chatbot prompt; older turns are
+# summarized in at most CHAT_SUMMARY_MAX_TOKENS once the window is full
+CHAT_MEMORY_TOKEN_WINDOW = int(os.getenv("CHAT_MEMORY_TOKEN_WINDOW", "600"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "120"))
+
+# Default and maximum number of conversations in one /simulate/ background job
+SIMULATION_JOB_DEFAULT_SIZE = int(os.getenv("SIMULATION_JOB_DEFAULT_SIZE", "100"))
+SIMULATION_JOB_MAX_SIZE = int(os.getenv("SIMULATION_JOB_MAX_SIZE", "1000"))
+
+# Model and prompt version used to classify conversations as vegetarian/vegan/neither.
+# Stored classifications are keyed on both, so bumping CLASSIFIER_PROMPT_VERSION invalidates them.
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "gpt-3.5-turbo")
+CLASSIFIER_PROMPT_VERSION = os.getenv("CLASSIFIER_PROMPT_VERSION", "2")   # 2: batch JSON prompt
+# Estimated prompt tokens packed into one batch classification request, and how often unparsed items are retried
+CLASSIFIER_BATCH_TOKEN_BUDGET = int(os.getenv("CLASSIFIER_BATCH_TOKEN_BUDGET", "3000"))
+CLASSIFIER_BATCH_RETRIES = int(os.getenv("CLASSIFIER_BATCH_RETRIES", "2"))
+
+# Default and maximum number of conversations read per page by the vegetarian users API
+VEGETARIAN_API_PAGE_SIZE = int(os.getenv("VEGETARIAN_API_PAGE_SIZE", "100"))
+VEGETARIAN_API_MAX_PAGE_SIZE = int(os.getenv("VEGETARIAN_API_MAX_PAGE_SIZE", "1000"))
+
+# Default and maximum number of conversations per page of full-text search results
+SEARCH_API_PAGE_SIZE = int(os.getenv("SEARCH_API_PAGE_SIZE", "20"))
+SEARCH_API_MAX_PAGE_SIZE = int(os.getenv("SEARCH_API_MAX_PAGE_SIZE", "100"))
+
+# Limits shared by every LLM call in a worker process: concurrent requests in flight,
+# token-bucket rate (requests per second, 0 disables) and burst size, and retries after a 429
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "3"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+# HTTP settings of the OpenAI client, created once per worker: connect and read timeouts in seconds, and a
+# keep-alive connection pool (one connection per concurrent call by default) whose idle connections are kept
+# for LLM_KEEPALIVE_EXPIRY seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", str(LLM_CONCURRENCY)))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+# Timeout in seconds of the request that opens the first connection when a worker starts
+LLM_WARM_UP_TIMEOUT = float(os.getenv("LLM_WARM_UP_TIMEOUT", "3"))
+
+# LLM backend: 'openai' calls the API, 'stub' answers offline for load tests and benchmarks.
+# LLM_RECORD_PATH records every request/response pair to a JSONL file, which the stub replays from LLM_REPLAY_PATH.
+# The stub draws latency from LLM_STUB_LATENCY ('fixed:S', 'uniform:A,B', 'exponential:MEAN' or
+# 'lognormal:MEDIAN,SIGMA', in seconds) and fails LLM_STUB_ERROR_RATE of calls with LLM_STUB_ERROR_STATUS.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH")
+LLM_REPLAY_PATH = os.getenv("LLM_REPLAY_PATH")
+LLM_STUB_LATENCY = os.getenv("LLM_STUB_LATENCY", "lognormal:0.8,0.4")
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+LLM_STUB_ERROR_STATUS = int(os.getenv("LLM_STUB_ERROR_STATUS", "429"))
+LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", "0"))
+
+# US dollar prices per 1,000 prompt and completion tokens, used to estimate LLM spend on /metrics.
+# Override with a JSON object such as '{"gpt-4o-mini": [0.00015, 0.0006]}'; unlisted models are counted at 0.
+LLM_PRICING = json.loads(os.getenv("LLM_PRICING", '{"gpt-3.5-turbo": [0.0005, 0.0015]}'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -50,6 +113,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "chatbot.middleware.RequestMetricsMiddleware", # First, so it times the whole middleware chain
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -83,11 +147,88 @@ WSGI_APPLICATION = "food_chatbot.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DATABASE_ENGINE selects 'sqlite' (default) or 'postgres'. Connections are kept open for DATABASE_CONN_MAX_AGE
+# seconds and checked before reuse, instead of being opened on every request.
+DATABASE_ENGINE = os.getenv("DATABASE_ENGINE", "sqlite")
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", "60"))
+
+if DATABASE_ENGINE == "postgres":
+    # POSTGRES_POOL_MAX_SIZE > 0 switches to Django's native connection pool, which needs psycopg 3 and
+    # replaces persistent connections; with psycopg2 each worker thread keeps one persistent connection.
+    POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "0"))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "food_chatbot"),
+            "USER": os.getenv("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            "CONN_MAX_AGE": 0 if POSTGRES_POOL_MAX_SIZE else DATABASE_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": 5,
+                "options": f"-c statement_timeout={os.getenv('POSTGRES_STATEMENT_TIMEOUT_MS', '30000')}",
+            },
+        }
+    }
+    if POSTGRES_POOL_MAX_SIZE:
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+            "max_size": POSTGRES_POOL_MAX_SIZE,
+            "timeout": 10,
+        }
+else:
+    # SQLite is tuned on every new connection: WAL lets readers run alongside the single writer,
+    # synchronous=NORMAL is durable across application crashes in WAL mode (only an OS crash can lose
+    # the last commits), and writers wait up to SQLITE_BUSY_TIMEOUT seconds for the lock instead of
+    # failing with "database is locked". IMMEDIATE transactions take the write lock up front, so two
+    # transactions never deadlock trying to upgrade a read lock.
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "20"))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "init_command": f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}; PRAGMA synchronous={SQLITE_SYNCHRONOUS};",
+                "timeout": SQLITE_BUSY_TIMEOUT,
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
     }
+
+# Write-behind mode for conversations saved by the chatbot: they are queued in memory and inserted by a
+# background thread in batches of CONVERSATION_WRITE_BEHIND_BATCH_SIZE, or every CONVERSATION_WRITE_BEHIND_INTERVAL
+# seconds, and flushed when the worker exits. Saved conversations then appear in queries after a short delay.
+# A batch failing CONVERSATION_WRITE_BEHIND_MAX_ATTEMPTS times is written row by row, dropping the rows that fail.
+CONVERSATION_WRITE_BEHIND = os.getenv("CONVERSATION_WRITE_BEHIND", "false").lower() in ("1", "true")
+CONVERSATION_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CONVERSATION_WRITE_BEHIND_BATCH_SIZE", "100"))
+CONVERSATION_WRITE_BEHIND_INTERVAL = float(os.getenv("CONVERSATION_WRITE_BEHIND_INTERVAL", "1.0"))
+CONVERSATION_WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("CONVERSATION_WRITE_BEHIND_MAX_ATTEMPTS", "3"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The 'responses' cache stores chatbot replies keyed on the normalized food list. The local-memory backend
+# evicts least recently used entries beyond MAX_ENTRIES; point RESPONSE_CACHE_BACKEND/LOCATION at e.g.
+# django.core.cache.backends.redis.RedisCache (with an allkeys-lru maxmemory policy) to share it across workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "responses": {
+        "BACKEND": os.getenv("RESPONSE_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("RESPONSE_CACHE_LOCATION", "chatbot-responses"),
+        "TIMEOUT": int(os.getenv("RESPONSE_CACHE_TTL", "3600")),   # Seconds a cached response stays valid
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+        },
+    },
 }
 
 
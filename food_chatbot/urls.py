@@ -27,5 +27,10 @@ urlpatterns = [
     path('login/', LoginView.as_view(template_name='login.html'), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('simulate/', views.simulate_conversation, name='simulate_conversation'),
+    path('simulate/<int:job_id>/', views.simulation_job_status, name='simulation_job_status'),
     path('api/vegetarian/', views.vegetarian_users_api, name='vegetarian_users_api'),
+    path('api/cache-stats/', views.response_cache_stats_api, name='response_cache_stats_api'),
+    path('api/stats/', views.dietary_stats_api, name='dietary_stats_api'),
+    path('api/search/', views.search_conversations_api, name='search_conversations_api'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
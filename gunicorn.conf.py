@@ -0,0 +1,33 @@
+"""
+Gunicorn configuration, read automatically when gunicorn is started from the project root:
+
+    gunicorn food_chatbot.asgi:application
+
+The application is imported once in the master and forked into the workers, so each worker starts with Django
+already set up. Every worker then creates its own LLM clients, since connection pools must not be shared across
+processes. The async client, which the uvicorn workers' requests use, is connected by the ASGI lifespan startup
+in food_chatbot/asgi.py before the worker serves, so cold-start and TLS handshake costs stay off the first
+user request.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn_worker.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))    # Above LLM_READ_TIMEOUT, so slow LLM calls time out first
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+preload_app = True
+
+
+def post_fork(server, worker):
+    """
+    Drops the database connections and LLM client inherited from the master, so the worker creates its own.
+    """
+    from django.db import connections
+
+    from chatbot import llm
+
+    connections.close_all()     # Connections opened by the master while preloading are not shared with workers
+    llm.set_backend(None)       # Nor is an LLM client the master may have created
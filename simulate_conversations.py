@@ -1,8 +1,12 @@
 import os
+import argparse
+import asyncio
 import django
+import json
 import openai
 import random
 import time
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
 from django.core.wsgi import get_wsgi_application
 
@@ -10,13 +14,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'food_chatbot.settings')
 django.setup()
 application = get_wsgi_application()
 
+from django.conf import settings
 from chatbot.models import Conversation
-
-# Clear all previous conversations
-Conversation.objects.all().delete()
+from chatbot import llm
+from chatbot.vocabulary import CANONICAL_FOODS
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 def chatgpt_a_ask():
     """
@@ -26,36 +29,22 @@ def chatgpt_a_ask():
     """
     return "What are your top 3 favorite foods? Please keep the description short and simple."
 
-def chatgpt_b_respond():
+async def chatgpt_b_respond():
     """
     Generates a response from a simulated food enthusiast by randomly selecting three foods
     and validating the response using the OpenAI API to ensure a natural and enthusiastic output.
+    Many responses can be awaited at once; the shared LLM rate limiter keeps them within quota.
 
     :return: A string containing a natural language response listing the top 3 favorite foods
     :raises: Exception if the OpenAI API call fails (e.g., invalid key or network issue)
     """
-    foods = [
-        "pizza", "chicken", "beef", "salad", "tofu", "lentils", "pasta", "rice",
-        "broccoli", "carrots", "spinach", "quinoa", "eggs", "fish", "shrimp", "turkey",
-        "avocado", "cheese", "bread", "beans", "potatoes", "sweet potatoes", "mushrooms",
-        "cucumber", "tomatoes", "oranges", "apples", "bananas", "berries", "yogurt", "oats",
-        "peanut butter", "almonds", "cashews", "walnuts", "hummus", "zucchini", "cauliflower",
-        "brussels sprouts", "asparagus", "onions", "garlic", "peppers", "corn", "peas",
-        "cabbage", "eggplant", "pineapple", "grapes", "melon", "cherries", "kiwi",
-        "mango", "papaya", "coconut", "figs", "dates", "raisins", "cranberries", "blueberries",
-        "sardines", "salmon", "tuna", "duck", "pork", "bacon", "sausages", "lamb",
-        "barley", "millet", "couscous", "bulgur", "buckwheat", "noodles", "gnocchi",
-        "tortilla", "pita", "bagel", "croissant", "pancakes", "waffles", "cereal",
-        "milk", "cream", "butter", "ice cream", "gelato", "chocolate", "jam", "honey",
-        "maple syrup", "soy milk", "almond milk", "coconut milk", "chia seeds", "flax seeds",
-        "sunflower seeds", "pumpkin seeds", "tempeh", "seitan", "clams", "scallops", "lobster"
-    ]
+    foods = list(CANONICAL_FOODS)
     random.shuffle(foods)
     top_3 = foods[:3]
 
     # Validate with OpenAI to ensure a natural response
-    response = openai.chat.completions.create(
-        model="gpt-3.5-turbo",
+    response = await llm.acreate(
+        model=settings.SIMULATION_MODEL,
         messages=[
             {"role": "system", "content": "You are a food enthusiast. "
                                           "List your top 3 favorite foods based on the suggestion."},
@@ -65,20 +54,162 @@ def chatgpt_b_respond():
     )
     return response.choices[0].message.content.strip() # Returns the cleaned AI-generated response listing the top 3 foods
 
-# Simulate 100 conversations
-results = []
-for i in range(100):
-    # Loops 100 times to simulate multiple conversations
+class AdaptiveLimiter:
+    """
+    Limits the number of simulated conversations in flight with additive-increase/multiplicative-decrease:
+    every success raises the limit by about one per round of requests, every failure halves it and doubles
+    the backoff delay, so the simulator slows down under rate limiting and speeds back up when it clears.
+    """
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.backoff = 0.0  # Seconds a worker waits after a failed request; reset by the next success
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self, success):
+        async with self.condition:
+            self.active -= 1
+            if success:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.backoff = 0.0
+            else:
+                self.limit = max(1.0, self.limit / 2)
+                self.backoff = min(max(self.backoff * 2, 1.0), 60.0)
+            self.condition.notify_all()
+
+
+class ResultWriter:
+    """
+    Streams simulation results to the results file as they arrive and inserts the conversations with
+    bulk_create in batches. After every batch it saves a checkpoint holding the number of stored
+    conversations and the matching results file offset, so an interrupted run can resume from there.
+    """
+    def __init__(self, results_path, checkpoint_path, target, completed, offset, batch_size, flush_interval):
+        self.checkpoint_path = checkpoint_path
+        self.target = target
+        self.completed = completed  # Conversations stored in the database and covered by the checkpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.lock = asyncio.Lock()
+        with open(results_path, "a") as f:
+            f.truncate(offset)  # Drops results written after the last checkpoint, which were never stored
+        self.file = open(results_path, "a")
+
+    async def add(self, question, answer):
+        async with self.lock:
+            iteration = self.completed + len(self.pending) + 1
+            self.file.write(f"Iteration: {iteration}\nQuestion: {question}\nAnswer: {answer}\n------\n")
+            self.file.flush()
+            self.pending.append(Conversation(user_input=question, bot_response=answer))
+            print(f"Iteration {iteration}: Question: {question}, Answer: {answer}")
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                await self._flush()
+
+    async def flush(self):
+        async with self.lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self.pending:
+            await sync_to_async(Conversation.objects.bulk_create)(self.pending)
+            self.completed += len(self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+        save_checkpoint(self.checkpoint_path, {"target": self.target, "completed": self.completed, "offset": self.file.tell()})
+
+    def close(self):
+        self.file.close()
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Writes the checkpoint atomically, so an interruption never leaves a half-written file.
+    """
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def simulate(count, concurrency, writer):
+    """
+    Simulates conversations concurrently, bounded by the adaptive limiter as well as LLM_CONCURRENCY and the
+    shared LLM rate limiter. Failed requests are retried after the limiter's backoff delay.
+
+    :param count: The number of conversations still to simulate
+    :param concurrency: The maximum number of conversations in flight
+    :param writer: The ResultWriter storing each answer as it arrives
+    """
+    limiter = AdaptiveLimiter(concurrency)
+    queue = asyncio.Queue()
+    for _ in range(count):
+        queue.put_nowait(None)
     question = chatgpt_a_ask()
-    answer = chatgpt_b_respond()
-    conversation = Conversation.objects.create(user_input=question, bot_response=answer)
-    results.append({"iteration": i+1, "question": question, "answer": answer})
-    print(f"Iteration {i+1}: Question: {question}, Answer: {answer}")
-    time.sleep(1) # Rate limit respect; pauses execution for 1 second to avoid overwhelming the API or database
-
-with open("conversation_results.txt", "w") as f:
-    # Opens a file to write the simulation results
-    for result in results:
-        f.write(f"Iteration: {result['iteration']}\nQuestion: {result['question']}\nAnswer: {result['answer']}\n------\n")
-
-print(f"Completed 100 simulations. Results saved to conversation_results.txt")
\ No newline at end of file
+
+    async def worker():
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await limiter.acquire()
+            try:
+                answer = await chatgpt_b_respond()
+            except openai.APIError as error:
+                await limiter.release(False)
+                print(f"Request failed ({error}); retrying in {limiter.backoff:.0f}s at concurrency {int(limiter.limit)}")
+                queue.put_nowait(None)  # Puts the conversation back for this or another worker to retry
+                await asyncio.sleep(limiter.backoff)
+                continue
+            await limiter.release(True)
+            await writer.add(question, answer)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates conversations and stores them in the database.")
+    parser.add_argument("-n", "--count", type=int, default=100, help="Total number of conversations to simulate")
+    parser.add_argument("-c", "--concurrency", type=int, default=settings.LLM_CONCURRENCY, help="Maximum conversations in flight")
+    parser.add_argument("--batch-size", type=int, default=100, help="Conversations inserted per bulk_create batch")
+    parser.add_argument("--flush-interval", type=float, default=5.0, help="Seconds after which a partial batch is inserted")
+    parser.add_argument("--results", default="conversation_results.txt", help="File the results are streamed to")
+    parser.add_argument("--checkpoint", default="conversation_results.checkpoint.json", help="Checkpoint file used to resume")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run instead of wiping previous data")
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.checkpoint) if args.resume else None
+    if checkpoint:
+        completed, offset = checkpoint["completed"], checkpoint["offset"]
+        print(f"Resuming after {completed} stored conversations")
+    else:
+        # Clear all previous conversations
+        Conversation.objects.all().delete()
+        completed, offset = 0, 0
+
+    writer = ResultWriter(args.results, args.checkpoint, args.count, completed, offset, args.batch_size, args.flush_interval)
+    try:
+        asyncio.run(simulate(max(args.count - completed, 0), args.concurrency, writer))
+    finally:
+        writer.close()
+    print(f"Completed {writer.completed} simulations. Results saved to {args.results}")
+
+
+if __name__ == "__main__":
+    main()